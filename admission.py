@@ -0,0 +1,165 @@
+"""
+Admission Control & Load Shedding
+Per-client token buckets and bounded per-route-class concurrency, so that
+bursts on write and chatbot endpoints fail fast (429/503 + Retry-After)
+instead of piling up behind SQLite locks and dragging reads down with them
+"""
+
+import math
+import threading
+import time
+
+import metrics
+
+# Endpoints (Flask view names) in each limited route class; anything else is "read"
+ROUTE_CLASSES = {
+    'write': {
+        'api_add_child', 'api_add_milestone', 'api_add_milestones_batch',
+        'api_mark_vaccination', 'api_add_growth_record', 'api_sync',
+        'api_book_consultation',
+    },
+    'chatbot': {
+        'api_chatbot',
+    },
+}
+
+# rate: tokens per second per client, burst: bucket size,
+# concurrency: requests running at once, max_queue: requests allowed to wait,
+# queue_timeout: longest wait (seconds) for a free slot before 503
+LIMITS = {
+    'write': {'rate': 5.0, 'burst': 20, 'concurrency': 4, 'max_queue': 16, 'queue_timeout': 0.5},
+    'chatbot': {'rate': 1.0, 'burst': 5, 'concurrency': 8, 'max_queue': 8, 'queue_timeout': 0.2},
+}
+
+# Client buckets tracked before idle (full) buckets are evicted
+MAX_CLIENTS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens/second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take one token; returns 0 on success or seconds until one is available"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class ConcurrencyLimiter:
+    """Semaphore with a bounded wait queue and exported depth"""
+
+    def __init__(self, route_class, concurrency, max_queue, queue_timeout):
+        self.route_class = route_class
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+
+    def acquire(self):
+        """Get a slot, waiting at most queue_timeout; False when over capacity"""
+        if self._semaphore.acquire(blocking=False):
+            self._started()
+            return True
+
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            metrics.set_gauge(f'admission_queue_depth_{self.route_class}', self.waiting)
+
+        acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+
+        with self._lock:
+            self.waiting -= 1
+            metrics.set_gauge(f'admission_queue_depth_{self.route_class}', self.waiting)
+        if acquired:
+            self._started()
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            metrics.set_gauge(f'admission_in_flight_{self.route_class}', self.in_flight)
+        self._semaphore.release()
+
+    def _started(self):
+        with self._lock:
+            self.in_flight += 1
+            metrics.set_gauge(f'admission_in_flight_{self.route_class}', self.in_flight)
+
+
+_limiters = {
+    route_class: ConcurrencyLimiter(route_class, limits['concurrency'],
+                                    limits['max_queue'], limits['queue_timeout'])
+    for route_class, limits in LIMITS.items()
+}
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def classify(endpoint):
+    """Route class of a Flask endpoint name"""
+    for route_class, endpoints in ROUTE_CLASSES.items():
+        if endpoint in endpoints:
+            return route_class
+    return 'read'
+
+
+def admit(route_class, client_id):
+    """
+    Decide whether a request may run
+
+    Returns: None if admitted (call release() when done), otherwise
+    (status_code, retry_after_seconds, message)
+    """
+    if route_class not in LIMITS:
+        return None
+
+    wait = _take_token(route_class, client_id)
+    if wait:
+        metrics.increment(f'admission_rejected_429_{route_class}')
+        return 429, math.ceil(wait), 'Too many requests, slow down'
+
+    if not _limiters[route_class].acquire():
+        metrics.increment(f'admission_rejected_503_{route_class}')
+        return 503, 1, 'Server busy, please retry shortly'
+
+    metrics.increment(f'admission_admitted_{route_class}')
+    return None
+
+
+def release(route_class):
+    """Free the concurrency slot taken by admit()"""
+    _limiters[route_class].release()
+
+
+def _take_token(route_class, client_id):
+    key = (route_class, client_id)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            if len(_buckets) >= MAX_CLIENTS:
+                for idle in [k for k, b in _buckets.items() if b.is_full()]:
+                    del _buckets[idle]
+            limits = LIMITS[route_class]
+            bucket = _buckets[key] = TokenBucket(limits['rate'], limits['burst'])
+        return bucket.take()
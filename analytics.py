@@ -0,0 +1,151 @@
+"""
+Population Milestone Analytics
+Achievement rates per milestone, age month and gender, answered from the
+milestone_rollup table (kept current by a trigger on milestones) and
+compared against the WHO min/typical/max bands
+"""
+
+import os
+
+import archive
+import shard_router
+from milestone_checker import MILESTONE_STANDARDS
+
+_ROLLUP_SELECT = '''
+    SELECT m.category, m.milestone_name, m.age_months,
+           COALESCE(c.gender, 'Unknown') AS gender,
+           COUNT(*) AS screened,
+           SUM(CASE WHEN m.achieved THEN 1 ELSE 0 END) AS achieved
+    FROM {schema}.milestones m
+    LEFT JOIN {schema}.children c ON c.id = m.child_id
+    GROUP BY m.category, m.milestone_name, m.age_months, COALESCE(c.gender, 'Unknown')
+'''
+
+
+def rebuild_rollup(conn, db_path=None):
+    """
+    Recompute milestone_rollup from raw milestones (backfill / repair)
+
+    With db_path, rows already moved to that shard's archive are included,
+    since archiving must not change population statistics.
+    """
+    sources = [_ROLLUP_SELECT.format(schema='main')]
+    attached = False
+    if db_path and os.path.exists(archive.archive_path(db_path)):
+        conn.execute('ATTACH DATABASE ? AS archive', (archive.archive_path(db_path),))
+        attached = True
+        sources.append(_ROLLUP_SELECT.format(schema='archive'))
+
+    try:
+        conn.execute('DELETE FROM milestone_rollup')
+        conn.execute(f'''
+            INSERT INTO milestone_rollup
+                (category, milestone_name, age_months, gender, screened, achieved)
+            SELECT category, milestone_name, age_months, gender, SUM(screened), SUM(achieved)
+            FROM ({' UNION ALL '.join(sources)})
+            GROUP BY category, milestone_name, age_months, gender
+        ''')
+        conn.commit()
+    finally:
+        if attached:
+            conn.execute('DETACH DATABASE archive')
+
+    return conn.execute('SELECT COUNT(*) FROM milestone_rollup').fetchone()[0]
+
+
+def query_rollup(conn, category=None, milestone_name=None, gender=None,
+                 age_from=None, age_to=None):
+    """Rollup rows matching the filters"""
+    query = 'SELECT * FROM milestone_rollup WHERE 1 = 1'
+    params = []
+    for column, value in [('category', category), ('milestone_name', milestone_name),
+                          ('gender', gender)]:
+        if value:
+            query += f' AND {column} = ?'
+            params.append(value)
+    if age_from is not None:
+        query += ' AND age_months >= ?'
+        params.append(age_from)
+    if age_to is not None:
+        query += ' AND age_months <= ?'
+        params.append(age_to)
+    return [dict(r) for r in conn.execute(query, params)]
+
+
+def summarize(rows, group_by=('age_months', 'gender')):
+    """
+    Merge rollup rows (e.g. from several shards) per milestone
+
+    Returns: list of {category, milestone_name, standard, screened, achieved,
+    achievement_rate, bands, breakdown}, where bands gives the achievement
+    rate before min, min..typical, typical..max and after max.
+    """
+    milestones = {}
+    for row in rows:
+        key = (row['category'], row['milestone_name'])
+        entry = milestones.setdefault(key, {'screened': 0, 'achieved': 0, 'groups': {}, 'bands': {}})
+        entry['screened'] += row['screened']
+        entry['achieved'] += row['achieved']
+
+        group = tuple(row[column] for column in group_by)
+        counts = entry['groups'].setdefault(group, [0, 0])
+        counts[0] += row['screened']
+        counts[1] += row['achieved']
+
+        standard = MILESTONE_STANDARDS.get(row['category'], {}).get(row['milestone_name'])
+        if standard:
+            counts = entry['bands'].setdefault(_band(row['age_months'], standard), [0, 0])
+            counts[0] += row['screened']
+            counts[1] += row['achieved']
+
+    results = []
+    for (category, milestone_name), entry in sorted(milestones.items()):
+        standard = MILESTONE_STANDARDS.get(category, {}).get(milestone_name)
+        results.append({
+            'category': category,
+            'milestone_name': milestone_name,
+            'standard': standard,
+            'screened': entry['screened'],
+            'achieved': entry['achieved'],
+            'achievement_rate': _rate(entry['screened'], entry['achieved']),
+            'bands': {
+                band: {'screened': s, 'achieved': a, 'achievement_rate': _rate(s, a)}
+                for band, (s, a) in entry['bands'].items()
+            },
+            'breakdown': [
+                dict(zip(group_by, group), screened=s, achieved=a, achievement_rate=_rate(s, a))
+                for group, (s, a) in sorted(entry['groups'].items())
+            ]
+        })
+    return results
+
+
+def _band(age_months, standard):
+    if age_months < standard['min']:
+        return 'before_min'
+    if age_months <= standard['typical']:
+        return 'min_to_typical'
+    if age_months <= standard['max']:
+        return 'typical_to_max'
+    return 'after_max'
+
+
+def _rate(screened, achieved):
+    return round(achieved / screened, 4) if screened else None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Milestone analytics rollup maintenance')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the rollup from raw milestones')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        for shard in shard_router.all_shards():
+            conn = shard_router.connect(shard, timeout=30.0)
+            rows = rebuild_rollup(conn, shard.path)
+            conn.close()
+            print(f"✓ {shard.clinic}: rollup rebuilt ({rows} rows)")
+    else:
+        parser.print_help()
@@ -1,27 +1,101 @@
-from flask import Flask, request, jsonify, render_template, redirect
+from flask import Flask, request, jsonify, render_template, redirect, Response, stream_with_context, send_file, g
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os
+import gzip
+import io
+import json
 import sqlite3
+import time
+import zlib
 from datetime import datetime, date, timedelta
-from milestone_checker import check_milestone_status, get_all_milestones, get_milestones_for_age
+from milestone_checker import check_milestone_status, get_all_milestones, get_milestones_for_age, get_risk_assessment
+from vaccine_schedule import VACCINE_SCHEDULE
+import export_db
+import backup_db
+import metrics
+import shard_router
+import change_feed
+import reports
+import scheduling
+import admission
+import archive
+import analytics
+import catchup
 
 app = Flask(__name__)
 CORS(app)
 
+# Behind N reverse proxies (TRUSTED_PROXIES=N), take the client address from
+# the last N X-Forwarded-For hops; otherwise the header is ignored
+if os.environ.get("TRUSTED_PROXIES"):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["TRUSTED_PROXIES"]))
+
 # ===== DATABASE HELPER =====
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def calculate_age_months(date_of_birth):
-    """Calculate age in months from date of birth"""
+def get_request_clinic():
+    """Clinic named by the request (X-Clinic-Id header or ?clinic=), if any"""
+    return request.headers.get('X-Clinic-Id') or request.values.get('clinic')
+
+def get_request_shards():
+    """Shard of the clinic named by the request, or every shard when none is named"""
+    clinic = get_request_clinic()
+    if clinic:
+        return [shard_router.get_shard(clinic)]
+    return shard_router.all_shards()
+
+def get_db(row_id=None):
+    """
+    Get database connection
+    
+    With a row id (child, milestone, vaccination or growth record), connect to
+    the shard encoded in that id; otherwise to the requesting clinic's shard.
+    """
+    if row_id is not None:
+        shard = shard_router.shard_for_id(row_id)
+    else:
+        shard = shard_router.get_shard(get_request_clinic())
+    return shard_router.connect(shard)
+
+def get_child_db(child_id):
+    """
+    Get database connection for reading a child's records
+    
+    Falls back to the shard's archive database once the child has been
+    archived, so read endpoints work the same for hot and archived children.
+    """
+    conn = get_db(child_id)
+    if conn.execute('SELECT 1 FROM children WHERE id = ?', (child_id,)).fetchone():
+        return conn
+    
+    archived = archive.find_archived_child(shard_router.shard_for_id(child_id).path, child_id)
+    if archived is None:
+        return conn
+    conn.close()
+    return archived
+
+def get_children_across_shards():
+    """Children of the requesting clinic, or of every clinic when none is named"""
+    shards = get_request_shards()
+    
+    def fetch(shard):
+        conn = shard_router.connect(shard)
+        try:
+            return [dict(c) for c in conn.execute('SELECT * FROM children ORDER BY created_at DESC')]
+        finally:
+            conn.close()
+    
+    children = [child for rows in shard_router.fan_out(fetch, shards) for child in rows]
+    children.sort(key=lambda c: c['created_at'], reverse=True)
+    return children
+
+def calculate_age_months(date_of_birth, as_of=None):
+    """Calculate age in months from date of birth (today, or on date as_of)"""
     if isinstance(date_of_birth, str):
         dob = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
     else:
         dob = date_of_birth
     
-    today = date.today()
+    today = as_of or date.today()
     months = (today.year - dob.year) * 12 + (today.month - dob.month)
     return months
 
@@ -43,6 +117,50 @@ def calculate_age_details(date_of_birth):
         'age_months': months
     }
 
+def replan_catchup(conn, child_ids):
+    """
+    Refresh catch-up dates after vaccinations were written
+    
+    The write itself is already committed, so a planning failure is only
+    logged; the nightly catchup.py run repairs the plan.
+    """
+    try:
+        catchup.plan_children(conn, child_ids)
+    except Exception as e:
+        print(f"Error planning catch-up for children {list(child_ids)}: {e}")
+
+@app.errorhandler(shard_router.UnknownClinicError)
+def handle_unknown_clinic(e):
+    """Requests naming a clinic (or an id) with no shard"""
+    return jsonify({'error': f'Unknown clinic: {e.args[0]}'}), 404
+
+# ===== ADMISSION CONTROL =====
+
+@app.before_request
+def admit_request():
+    """Shed load on write/chatbot routes before they queue behind SQLite locks"""
+    g.request_started = time.monotonic()
+    g.route_class = admission.classify(request.endpoint)
+    
+    # remote_addr, not X-Forwarded-For, which any client can set (see ProxyFix above)
+    rejection = admission.admit(g.route_class, request.remote_addr)
+    if rejection:
+        status, retry_after, message = rejection
+        g.route_class = None
+        response = jsonify({'status': 'error', 'message': message})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, status
+    g.admitted = True
+
+@app.teardown_request
+def release_request(exc):
+    """Free the admission slot and record latency per route class"""
+    if g.get('admitted') and g.route_class in admission.LIMITS:
+        admission.release(g.route_class)
+    if g.get('route_class'):
+        metrics.observe(f'request_latency_seconds_{g.route_class}',
+                        time.monotonic() - g.request_started)
+
 # ===== ROUTES (WEB PAGES) =====
 
 @app.route('/')
@@ -64,7 +182,7 @@ def consultation():
 @app.route('/child/<int:child_id>/add_milestone')
 def add_milestone_page(child_id):
     """Add milestone page for specific child"""
-    conn = get_db()
+    conn = get_db(child_id)
     child = conn.execute('SELECT * FROM children WHERE id = ?', (child_id,)).fetchone()
     conn.close()
     
@@ -82,14 +200,9 @@ def api_add_milestone_page(child_id):
 @app.route('/dashboard')
 def dashboard():
     """Dashboard showing all children"""
-    conn = get_db()
-    children = conn.execute('SELECT * FROM children ORDER BY created_at DESC').fetchall()
-    conn.close()
-    
     children_list = []
-    for child in children:
-        child_dict = dict(child)
-        age_info = calculate_age_details(child['date_of_birth'])
+    for child_dict in get_children_across_shards():
+        age_info = calculate_age_details(child_dict['date_of_birth'])
         child_dict.update(age_info)
         children_list.append(child_dict)
     
@@ -103,7 +216,7 @@ def add_child():
 @app.route('/child/<int:child_id>')
 def child_detail(child_id):
     """Detailed view of a child"""
-    conn = get_db()
+    conn = get_child_db(child_id)
     
     child = conn.execute('SELECT * FROM children WHERE id = ?', (child_id,)).fetchone()
     if not child:
@@ -115,8 +228,9 @@ def child_detail(child_id):
     age_info = calculate_age_details(child['date_of_birth'])
     child_dict.update(age_info)
     
+    # Current state only; the full history is at /api/child/<id>/milestones/history
     milestones = conn.execute('''
-        SELECT * FROM milestones 
+        SELECT * FROM milestone_status 
         WHERE child_id = ? 
         ORDER BY date_recorded DESC
     ''', (child_id,)).fetchall()
@@ -133,7 +247,7 @@ def child_detail(child_id):
         ORDER BY age_months
     ''', (child_id,)).fetchall()
     
-    alerts = get_alerts_for_child(child_id)
+    alerts = get_alerts_for_child(child_id, conn)
     
     conn.close()
     
@@ -150,14 +264,9 @@ def child_detail(child_id):
 @app.route('/api/children', methods=['GET'])
 def api_get_children():
     """Get all children"""
-    conn = get_db()
-    children = conn.execute('SELECT * FROM children ORDER BY created_at DESC').fetchall()
-    conn.close()
-    
     children_list = []
-    for child in children:
-        child_dict = dict(child)
-        age_info = calculate_age_details(child['date_of_birth'])
+    for child_dict in get_children_across_shards():
+        age_info = calculate_age_details(child_dict['date_of_birth'])
         child_dict.update(age_info)
         children_list.append(child_dict)
     
@@ -168,8 +277,7 @@ def api_add_child():
     """Add a new child"""
     data = request.form
     
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -188,33 +296,7 @@ def api_add_child():
         else:
             dob = data['date_of_birth']
         
-        vaccines = [
-            ("BCG", 0),
-            ("Hepatitis B - Birth dose", 0),
-            ("OPV - 0", 0),
-            ("DTaP - 1st dose", 6),
-            ("IPV - 1st dose", 6),
-            ("Hib - 1st dose", 6),
-            ("Hepatitis B - 1st dose", 6),
-            ("Rotavirus - 1st dose", 6),
-            ("DTaP - 2nd dose", 10),
-            ("IPV - 2nd dose", 10),
-            ("Hib - 2nd dose", 10),
-            ("Rotavirus - 2nd dose", 10),
-            ("DTaP - 3rd dose", 14),
-            ("IPV - 3rd dose", 14),
-            ("Hib - 3rd dose", 14),
-            ("Hepatitis B - 2nd dose", 14),
-            ("Rotavirus - 3rd dose", 14),
-            ("MMR - 1st dose", 36),
-            ("Typhoid", 36),
-            ("MMR - 2nd dose", 60),
-            ("Varicella - 1st dose", 60),
-            ("DTaP Booster", 72),
-            ("IPV Booster", 72),
-        ]
-        
-        for vaccine_name, weeks in vaccines:
+        for vaccine_name, weeks in VACCINE_SCHEDULE:
             due_date = dob + timedelta(weeks=weeks)
             cursor.execute('''
                 INSERT INTO vaccinations (child_id, vaccine_name, due_date, status)
@@ -227,6 +309,9 @@ def api_add_child():
         conn.rollback()
         print(f"Error: {e}")
         return f"Error adding child: {e}", 500
+    else:
+        # Children registered late start with overdue doses
+        replan_catchup(conn, [child_id])
     finally:
         conn.close()
     
@@ -235,7 +320,7 @@ def api_add_child():
 @app.route('/api/child/<int:child_id>', methods=['GET'])
 def api_get_child(child_id):
     """Get specific child details"""
-    conn = get_db()
+    conn = get_child_db(child_id)
     child = conn.execute('SELECT * FROM children WHERE id = ?', (child_id,)).fetchone()
     conn.close()
     
@@ -256,8 +341,7 @@ def api_add_milestone():
     child_id = int(data['child_id'])
     achieved = data.get('achieved') == 'yes'
     
-    conn = sqlite3.connect('database.db', timeout=10.0)
-    conn.row_factory = sqlite3.Row
+    conn = get_db(child_id)
     
     try:
         child = conn.execute('SELECT date_of_birth FROM children WHERE id = ?', 
@@ -294,6 +378,123 @@ def api_add_milestone():
     
     return redirect(f'/child/{child_id}')
 
+@app.route('/api/child/<int:child_id>/milestones', methods=['GET'])
+def api_get_milestones(child_id):
+    """Latest result for each milestone screened for a child"""
+    conn = get_child_db(child_id)
+    milestones = conn.execute('''
+        SELECT * FROM milestone_status 
+        WHERE child_id = ? 
+        ORDER BY category, milestone_name
+    ''', (child_id,)).fetchall()
+    conn.close()
+    
+    return jsonify([dict(m) for m in milestones])
+
+@app.route('/api/child/<int:child_id>/milestones/history', methods=['GET'])
+def api_get_milestone_history(child_id):
+    """Every recorded screening for a child (optionally one ?category= / ?milestone_name=)"""
+    query = 'SELECT * FROM milestones WHERE child_id = ?'
+    params = [child_id]
+    for field in ('category', 'milestone_name'):
+        if request.args.get(field):
+            query += f' AND {field} = ?'
+            params.append(request.args[field])
+    query += ' ORDER BY date_recorded DESC, id DESC'
+    
+    conn = get_child_db(child_id)
+    history = conn.execute(query, params).fetchall()
+    conn.close()
+    
+    return jsonify([dict(m) for m in history])
+
+# Largest screening checklist accepted in one batch
+MAX_MILESTONE_BATCH = 200
+
+@app.route('/api/child/<int:child_id>/milestones/batch', methods=['POST'])
+def api_add_milestones_batch(child_id):
+    """
+    Record a whole screening checklist in one request and one transaction
+    
+    Body: {"milestones": [{"category", "milestone_name", "achieved"}, ...]}
+    (a bare list works too, and "milestone" is accepted as returned by
+    get_milestones_for_age). Returns the computed risk levels and a
+    refreshed risk assessment.
+    """
+    data = request.get_json(silent=True)
+    entries = data.get('milestones') if isinstance(data, dict) else data
+    
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'Expected a non-empty list of milestones'}), 400
+    if len(entries) > MAX_MILESTONE_BATCH:
+        return jsonify({'error': f'At most {MAX_MILESTONE_BATCH} milestones per batch'}), 400
+    
+    parsed = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            return jsonify({'error': f'Milestone {i} must be an object'}), 400
+        category = entry.get('category')
+        milestone_name = entry.get('milestone_name') or entry.get('milestone')
+        if not category or not milestone_name:
+            return jsonify({'error': f'Milestone {i} needs category and milestone_name'}), 400
+        achieved = entry.get('achieved')
+        if isinstance(achieved, str):
+            achieved = achieved.lower() in ('yes', 'true', '1')
+        parsed.append((category, milestone_name, bool(achieved)))
+    
+    conn = get_db(child_id)
+    
+    try:
+        child = conn.execute('SELECT date_of_birth FROM children WHERE id = ?', 
+                            (child_id,)).fetchone()
+        
+        if not child:
+            return jsonify({'error': 'Child not found'}), 404
+        
+        age_months = calculate_age_months(child['date_of_birth'])
+        today = date.today()
+        
+        # Score everything in one pass, then write it in one transaction
+        results = []
+        rows = []
+        for category, milestone_name, achieved in parsed:
+            risk_level = check_milestone_status(category, milestone_name, age_months, achieved)
+            results.append({
+                'category': category,
+                'milestone_name': milestone_name,
+                'achieved': achieved,
+                'risk_level': risk_level
+            })
+            rows.append((child_id, age_months, category, milestone_name,
+                         achieved, today, risk_level))
+        
+        conn.executemany('''
+            INSERT INTO milestones 
+            (child_id, age_months, category, milestone_name, achieved, date_recorded, risk_level)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+        
+        milestones = conn.execute('''
+            SELECT category, risk_level FROM milestone_status WHERE child_id = ?
+        ''', (child_id,)).fetchall()
+        assessment = get_risk_assessment([dict(m) for m in milestones], age_months)
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        conn.close()
+    
+    return jsonify({
+        'status': 'success',
+        'child_id': child_id,
+        'age_months': age_months,
+        'results': results,
+        'assessment': assessment
+    })
+
 @app.route('/api/milestones/available', methods=['GET'])
 def api_get_available_milestones():
     """Get all available milestones from WHO standards"""
@@ -304,7 +505,7 @@ def api_get_available_milestones():
 @app.route('/api/child/<int:child_id>/vaccinations', methods=['GET'])
 def api_get_vaccinations(child_id):
     """Get vaccination schedule for a child"""
-    conn = get_db()
+    conn = get_child_db(child_id)
     vaccines = conn.execute('''
         SELECT * FROM vaccinations 
         WHERE child_id = ? 
@@ -324,31 +525,51 @@ def api_mark_vaccination():
     else:
         data = request.form
     
-    conn = get_db()
+    try:
+        vaccination_id = int(data['vaccination_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'vaccination_id is required'}), 400
+    try:
+        given_date = datetime.strptime(data.get('given_date', str(date.today())), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'given_date must be YYYY-MM-DD'}), 400
+    
+    conn = get_db(vaccination_id)
     
     try:
         conn.execute('''
             UPDATE vaccinations 
             SET status = 'completed', given_date = ?
             WHERE id = ?
-        ''', (data.get('given_date', str(date.today())), data['vaccination_id']))
+        ''', (given_date, vaccination_id))
         conn.commit()
-        
-        return jsonify({'status': 'success', 'message': 'Vaccination marked as completed'})
     except Exception as e:
         conn.rollback()
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-    finally:
         conn.close()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    # Later doses of the series move with the date this one was given
+    vaccination = conn.execute('SELECT child_id FROM vaccinations WHERE id = ?',
+                               (vaccination_id,)).fetchone()
+    if vaccination:
+        replan_catchup(conn, [vaccination['child_id']])
+    conn.close()
+    
+    return jsonify({'status': 'success', 'message': 'Vaccination marked as completed'})
 
 @app.route('/api/growth', methods=['POST'])
 def api_add_growth_record():
     """Add growth record (weight/height)"""
     data = request.form
     
-    conn = get_db()
+    try:
+        child_id = int(data['child_id'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'child_id is required'}), 400
+    
+    conn = get_db(child_id)
     child = conn.execute('SELECT date_of_birth FROM children WHERE id = ?', 
-                        (data['child_id'],)).fetchone()
+                        (child_id,)).fetchone()
     
     if not child:
         conn.close()
@@ -361,7 +582,7 @@ def api_add_growth_record():
         INSERT INTO growth_records 
         (child_id, age_months, weight_kg, height_cm, date_recorded)
         VALUES (?, ?, ?, ?, ?)
-    ''', (data['child_id'], age_months, data['weight_kg'], 
+    ''', (child_id, age_months, data['weight_kg'], 
           data['height_cm'], date.today()))
     
     record_id = cursor.lastrowid
@@ -373,7 +594,7 @@ def api_add_growth_record():
 @app.route('/api/child/<int:child_id>/growth', methods=['GET'])
 def api_get_growth_records(child_id):
     """Get growth history for a child"""
-    conn = get_db()
+    conn = get_child_db(child_id)
     records = conn.execute('''
         SELECT * FROM growth_records 
         WHERE child_id = ? 
@@ -383,13 +604,342 @@ def api_get_growth_records(child_id):
     
     return jsonify([dict(r) for r in records])
 
-def get_alerts_for_child(child_id):
+# ----- OFFLINE SYNC -----
+
+# Operations applied per transaction, and largest accepted upload
+SYNC_CHUNK_SIZE = 500
+MAX_SYNC_OPERATIONS = 10000
+MAX_SYNC_BYTES = 32 * 1024 * 1024
+
+@app.route('/api/sync', methods=['POST'])
+def api_sync():
+    """
+    Apply a batch of offline operations from a field device
+    
+    Body (JSON, optionally gzip/deflate via Content-Encoding):
+    {"operations": [{"key": "<client uuid>", "type": "growth" | "milestone" | "vaccination",
+                     "data": {...}}, ...]}
+    
+    Every operation carries an idempotency key; replaying a key returns
+    "duplicate" with the original row id instead of writing again.
+    """
+    try:
+        payload = decode_sync_payload(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({'error': 'Expected {"operations": [...]}'}), 400
+    if len(operations) > MAX_SYNC_OPERATIONS:
+        return jsonify({'error': f'At most {MAX_SYNC_OPERATIONS} operations per sync'}), 400
+    
+    # Route each operation to the shard encoded in its child/vaccination id
+    results = [None] * len(operations)
+    by_shard = {}
+    for i, op in enumerate(operations):
+        try:
+            op_type, row_id = get_sync_target(op)
+            shard = shard_router.shard_for_id(row_id)
+        except (ValueError, TypeError, shard_router.UnknownClinicError) as e:
+            results[i] = {'key': op.get('key') if isinstance(op, dict) else None,
+                          'status': 'error', 'message': str(e)}
+            continue
+        by_shard.setdefault(shard, []).append((i, op))
+    
+    def apply(shard):
+        return apply_sync_operations(shard, by_shard[shard])
+    
+    for shard_results in shard_router.fan_out(apply, list(by_shard)):
+        for i, result in shard_results:
+            results[i] = result
+    
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    
+    return jsonify({'results': results, 'summary': summary})
+
+def decode_sync_payload(req):
+    """Read a (possibly gzip/deflate compressed) JSON sync body"""
+    raw = req.get_data(cache=False)
+    encoding = req.headers.get('Content-Encoding', '').lower()
+    
+    try:
+        if encoding == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(raw)).read(MAX_SYNC_BYTES + 1)
+        elif encoding == 'deflate':
+            body = zlib.decompressobj().decompress(raw, MAX_SYNC_BYTES + 1)
+        elif encoding in ('', 'identity'):
+            body = raw
+        else:
+            raise ValueError(f'Unsupported Content-Encoding: {encoding}')
+    except (OSError, zlib.error, EOFError) as e:
+        raise ValueError(f'Could not decompress body: {e}')
+    
+    if len(body) > MAX_SYNC_BYTES:
+        raise ValueError('Sync payload too large')
+    
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise ValueError('Body is not valid JSON')
+
+def get_sync_target(op):
+    """Validate an operation's envelope and return (type, id used for routing)"""
+    if not isinstance(op, dict):
+        raise ValueError('Operation must be an object')
+    if not op.get('key') or not isinstance(op['key'], str):
+        raise ValueError('Operation needs a string idempotency key')
+    data = op.get('data')
+    if not isinstance(data, dict):
+        raise ValueError('Operation needs a data object')
+    
+    op_type = op.get('type')
+    if op_type in ('growth', 'milestone'):
+        id_field = 'child_id'
+    elif op_type == 'vaccination':
+        id_field = 'vaccination_id'
+    else:
+        raise ValueError(f'Unknown operation type: {op_type}')
+    
+    if id_field not in data:
+        raise ValueError(f'Missing field: {id_field}')
+    return op_type, int(data[id_field])
+
+def apply_sync_operations(shard, indexed_ops):
+    """
+    Apply one shard's operations in chunked transactions
+    
+    Each operation runs in its own savepoint, so a bad record is reported
+    without undoing the rest of its chunk.
+    
+    Returns: list of (position, result)
+    """
+    conn = shard_router.connect(shard, timeout=30.0)
+    conn.isolation_level = None
+    results = []
+    
+    try:
+        for start in range(0, len(indexed_ops), SYNC_CHUNK_SIZE):
+            chunk = indexed_ops[start:start + SYNC_CHUNK_SIZE]
+            
+            # Birth dates for every child in the chunk in one query
+            child_ids = {int(op['data']['child_id']) for _, op in chunk if op['type'] != 'vaccination'}
+            birth_dates = {}
+            if child_ids:
+                placeholders = ','.join('?' * len(child_ids))
+                for row in conn.execute(f'SELECT id, date_of_birth FROM children WHERE id IN ({placeholders})',
+                                        list(child_ids)):
+                    birth_dates[row['id']] = row['date_of_birth']
+            
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                chunk_results = [(i, apply_sync_operation(conn, op, birth_dates)) for i, op in chunk]
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            results.extend(chunk_results)
+            
+            # Doses given offline move the rest of their series
+            given = [result['id'] for (_, op), (_, result) in zip(chunk, chunk_results)
+                     if op['type'] == 'vaccination' and result['status'] == 'applied']
+            if given:
+                placeholders = ','.join('?' * len(given))
+                replan_catchup(conn, [row['child_id'] for row in conn.execute(
+                    f'SELECT DISTINCT child_id FROM vaccinations WHERE id IN ({placeholders})', given)])
+    finally:
+        conn.close()
+    
+    return results
+
+def apply_sync_operation(conn, op, birth_dates):
+    """Apply a single operation unless its idempotency key was already used"""
+    key = op['key']
+    
+    conn.execute('SAVEPOINT sync_op')
+    try:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO sync_keys (idempotency_key, op_type, applied_at)
+            VALUES (?, ?, ?)
+        ''', (key, op['type'], datetime.now()))
+        
+        if cursor.rowcount == 0:
+            conn.execute('RELEASE sync_op')
+            existing = conn.execute('SELECT row_id FROM sync_keys WHERE idempotency_key = ?',
+                                    (key,)).fetchone()
+            return {'key': key, 'status': 'duplicate', 'id': existing['row_id']}
+        
+        row_id = write_sync_record(conn, op['type'], op['data'], birth_dates)
+        conn.execute('UPDATE sync_keys SET row_id = ? WHERE idempotency_key = ?', (row_id, key))
+        conn.execute('RELEASE sync_op')
+        return {'key': key, 'status': 'applied', 'id': row_id}
+    
+    except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+        conn.execute('ROLLBACK TO sync_op')
+        conn.execute('RELEASE sync_op')
+        message = f'Missing field: {e.args[0]}' if isinstance(e, KeyError) else str(e)
+        return {'key': key, 'status': 'error', 'message': message}
+
+def write_sync_record(conn, op_type, data, birth_dates):
+    """Insert or update the row for one operation and return its id"""
+    recorded = data.get('date_recorded') or str(date.today())
+    recorded_date = datetime.strptime(recorded, '%Y-%m-%d').date()
+    
+    if op_type == 'vaccination':
+        given = data.get('given_date', str(date.today()))
+        given_date = datetime.strptime(given, '%Y-%m-%d').date()
+        cursor = conn.execute('''
+            UPDATE vaccinations 
+            SET status = 'completed', given_date = ?
+            WHERE id = ?
+        ''', (given_date, int(data['vaccination_id'])))
+        if cursor.rowcount == 0:
+            raise ValueError('Vaccination not found')
+        return int(data['vaccination_id'])
+    
+    child_id = int(data['child_id'])
+    if child_id not in birth_dates:
+        raise ValueError('Child not found')
+    if recorded_date < datetime.strptime(birth_dates[child_id], '%Y-%m-%d').date():
+        raise ValueError('date_recorded is before the date of birth')
+    age_months = calculate_age_months(birth_dates[child_id], recorded_date)
+    
+    if op_type == 'growth':
+        cursor = conn.execute('''
+            INSERT INTO growth_records 
+            (child_id, age_months, weight_kg, height_cm, date_recorded)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (child_id, age_months, float(data['weight_kg']),
+              float(data['height_cm']), recorded_date))
+        return cursor.lastrowid
+    
+    achieved = data.get('achieved')
+    if isinstance(achieved, str):
+        achieved = achieved.lower() in ('yes', 'true', '1')
+    achieved = bool(achieved)
+    risk_level = check_milestone_status(data['category'], data['milestone_name'],
+                                        age_months, achieved)
+    cursor = conn.execute('''
+        INSERT INTO milestones 
+        (child_id, age_months, category, milestone_name, achieved, date_recorded, risk_level)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (child_id, age_months, data['category'], data['milestone_name'],
+          achieved, recorded_date, risk_level))
+    return cursor.lastrowid
+
+# ----- CHANGE FEED -----
+
+@app.route('/api/changes', methods=['GET'])
+def api_get_changes():
+    """
+    Rows changed since ?since=<cursor>
+    
+    mode=poll (default) answers at once, mode=longpoll waits up to ?timeout=
+    seconds for a change, mode=sse streams server-sent events. Without a
+    cursor only the current cursor is returned, to start syncing from.
+    """
+    child_id = request.args.get('child_id', type=int)
+    if child_id is not None:
+        shard = shard_router.shard_for_id(child_id)
+    else:
+        shard = shard_router.get_shard(get_request_clinic())
+    connect = lambda: shard_router.connect(shard)
+    
+    mode = request.args.get('mode', 'poll')
+    limit = request.args.get('limit', change_feed.MAX_BATCH, type=int)
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    
+    if since is None:
+        conn = connect()
+        cursor = change_feed.get_latest_cursor(conn)
+        conn.close()
+        if mode != 'sse':
+            return jsonify({'changes': [], 'cursor': cursor})
+        since = cursor
+    
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'since must be an integer cursor'}), 400
+    
+    if mode == 'sse':
+        stream = change_feed.stream_changes(connect, since, child_id)
+        return Response(stream_with_context(stream), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    try:
+        if mode == 'longpoll':
+            timeout = request.args.get('timeout', change_feed.MAX_LONG_POLL, type=float)
+            changes, cursor = change_feed.wait_for_changes(connect, since, timeout, limit, child_id)
+        elif mode == 'poll':
+            conn = connect()
+            try:
+                changes, cursor = change_feed.fetch_changes(conn, since, limit, child_id)
+            finally:
+                conn.close()
+        else:
+            return jsonify({'error': f'Unknown mode: {mode}'}), 400
+    except change_feed.CursorExpiredError:
+        return jsonify({'error': 'Cursor expired, refetch everything and restart from the current cursor'}), 410
+    
+    return jsonify({'changes': changes, 'cursor': cursor})
+
+# ----- EXPORT APIs -----
+
+@app.route('/api/export/<table>', methods=['GET'])
+def api_export_table(table):
+    """Stream a full or incremental (?since=<change cursor>) table export as CSV or Parquet"""
+    if table not in export_db.EXPORT_TABLES:
+        return jsonify({'error': f'Unknown table: {table}'}), 404
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'parquet'):
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since must be an integer cursor'}), 400
+
+    if fmt == 'parquet':
+        try:
+            export_db.import_pyarrow()
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 501
+
+    conn = export_db.open_export_connection(shard_router.get_shard(get_request_clinic()).path)
+    until = export_db.get_high_water_mark(conn)
+    try:
+        change_feed.check_cursor(conn, since)
+    except change_feed.CursorExpiredError:
+        conn.close()
+        return jsonify({'error': 'Cursor expired, export the table in full and restart from its high-water mark'}), 410
+
+    def generate():
+        try:
+            if fmt == 'csv':
+                yield from export_db.iter_csv(conn, table, since, until)
+            else:
+                yield from export_db.iter_parquet(conn, table, since, until)
+        finally:
+            conn.close()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/vnd.apache.parquet'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={table}.{fmt}',
+        'X-High-Water-Mark': str(until)
+    })
+
+def get_alerts_for_child(child_id, conn=None):
     """Check for alerts for a specific child"""
     alerts = []
-    conn = get_db()
+    own_conn = conn is None
+    if own_conn:
+        conn = get_child_db(child_id)
     
     high_risk = conn.execute('''
-        SELECT category, milestone_name, age_months FROM milestones
+        SELECT category, milestone_name, age_months FROM milestone_status
         WHERE child_id = ? AND risk_level = 'high_risk'
     ''', (child_id,)).fetchall()
     
@@ -402,7 +952,7 @@ def get_alerts_for_child(child_id):
         })
     
     mild_delays = conn.execute('''
-        SELECT category, milestone_name, age_months FROM milestones
+        SELECT category, milestone_name, age_months FROM milestone_status
         WHERE child_id = ? AND risk_level = 'mild_delay'
     ''', (child_id,)).fetchall()
     
@@ -416,17 +966,23 @@ def get_alerts_for_child(child_id):
     
     today = date.today()
     overdue_vaccines = conn.execute('''
-        SELECT vaccine_name, due_date FROM vaccinations
+        SELECT vaccine_name, due_date, catchup_date FROM vaccinations
         WHERE child_id = ? AND status = 'pending' AND due_date < ?
     ''', (child_id, today)).fetchall()
     
     for v in overdue_vaccines:
         days_overdue = (today - date.fromisoformat(v['due_date'])).days
         severity = "high" if days_overdue > 30 else "medium"
+        message = f"💉 VACCINE OVERDUE: {v['vaccine_name']} (due: {v['due_date']}, {days_overdue} days overdue)"
+        if v['catchup_date'] and v['catchup_date'] <= today.isoformat():
+            message += " - catch up now"
+        elif v['catchup_date']:
+            message += f" - catch up on {v['catchup_date']}"
         alerts.append({
             "type": "vaccine_overdue",
             "severity": severity,
-            "message": f"💉 VACCINE OVERDUE: {v['vaccine_name']} (due: {v['due_date']}, {days_overdue} days overdue)"
+            "message": message,
+            "catchup_date": v['catchup_date']
         })
     
     upcoming_date = today + timedelta(days=7)
@@ -459,7 +1015,8 @@ def get_alerts_for_child(child_id):
                 "message": f"📉 GROWTH CONCERN: No weight gain or weight loss detected"
             })
     
-    conn.close()
+    if own_conn:
+        conn.close()
     return alerts
 
 @app.route('/api/child/<int:child_id>/alerts', methods=['GET'])
@@ -468,6 +1025,266 @@ def api_get_alerts(child_id):
     alerts = get_alerts_for_child(child_id)
     return jsonify(alerts)
 
+@app.route('/api/alerts', methods=['GET'])
+def api_get_cohort_alerts():
+    """Alerts for every child of the requesting clinic (or of all clinics)"""
+    shards = get_request_shards()
+    severity = request.args.get('severity')
+    
+    def collect(shard):
+        conn = shard_router.connect(shard)
+        try:
+            cohort = []
+            for child in conn.execute('SELECT id, name FROM children ORDER BY id').fetchall():
+                alerts = get_alerts_for_child(child['id'], conn)
+                if severity:
+                    alerts = [a for a in alerts if a['severity'] == severity]
+                if alerts:
+                    cohort.append({
+                        'child_id': child['id'],
+                        'name': child['name'],
+                        'clinic': shard.clinic,
+                        'alerts': alerts
+                    })
+            return cohort
+        finally:
+            conn.close()
+    
+    results = [entry for cohort in shard_router.fan_out(collect, shards) for entry in cohort]
+    return jsonify(results)
+
+# ----- VACCINATION CATCH-UP -----
+
+@app.route('/api/child/<int:child_id>/catchup', methods=['GET'])
+def api_get_child_catchup(child_id):
+    """Proposed catch-up dates for a child's overdue doses"""
+    conn = get_child_db(child_id)
+    doses = conn.execute('''
+        SELECT id, vaccine_name, due_date, catchup_date, catchup_note FROM vaccinations
+        WHERE child_id = ? AND status = 'pending'
+        AND (catchup_date IS NOT NULL OR catchup_note IS NOT NULL)
+        ORDER BY catchup_date, due_date
+    ''', (child_id,)).fetchall()
+    conn.close()
+    
+    return jsonify([dict(d) for d in doses])
+
+@app.route('/api/catchup', methods=['GET'])
+def api_get_cohort_catchup():
+    """
+    Catch-up plan for every child of the requesting clinic (or of all clinics)
+    
+    Paged by vaccination id: pass ?after=<next_after> to continue, ?limit=
+    (max 5000); ?due_by=YYYY-MM-DD only lists doses to give by that date.
+    """
+    shards = get_request_shards()
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 5000)
+    
+    query = '''
+        SELECT v.id, v.child_id, c.name, v.vaccine_name, v.due_date, v.catchup_date, v.catchup_note
+        FROM vaccinations v
+        JOIN children c ON c.id = v.child_id
+        WHERE (v.catchup_date IS NOT NULL OR v.catchup_note IS NOT NULL)
+        AND v.status = 'pending' AND v.id > ?
+    '''
+    params = [after]
+    if request.args.get('due_by'):
+        query += ' AND v.catchup_date <= ?'
+        params.append(request.args['due_by'])
+    query += ' ORDER BY v.id LIMIT ?'
+    params.append(limit)
+    
+    def collect(shard):
+        conn = shard_router.connect(shard)
+        try:
+            return [dict(d, clinic=shard.clinic) for d in conn.execute(query, params)]
+        finally:
+            conn.close()
+            
+    doses = sorted((d for rows in shard_router.fan_out(collect, shards) for d in rows),
+                   key=lambda d: d['id'])[:limit]
+    return jsonify({
+        'doses': doses,
+        'next_after': doses[-1]['id'] if len(doses) == limit else None
+    })
+
+# ----- HEALTH REPORTS -----
+
+def build_child_report(child_id):
+    """Gather everything on a child's printable report and render it to HTML"""
+    conn = get_child_db(child_id)
+    try:
+        child = conn.execute('SELECT * FROM children WHERE id = ?', (child_id,)).fetchone()
+        child_dict = dict(child)
+        child_dict.update(calculate_age_details(child['date_of_birth']))
+        
+        milestones = [dict(m) for m in conn.execute('''
+            SELECT * FROM milestone_status 
+            WHERE child_id = ? 
+            ORDER BY category, date_recorded DESC
+        ''', (child_id,))]
+        vaccinations = conn.execute('''
+            SELECT * FROM vaccinations 
+            WHERE child_id = ? 
+            ORDER BY due_date
+        ''', (child_id,)).fetchall()
+        growth = conn.execute('''
+            SELECT * FROM growth_records 
+            WHERE child_id = ? 
+            ORDER BY age_months
+        ''', (child_id,)).fetchall()
+        alerts = get_alerts_for_child(child_id, conn)
+        data_version = reports.get_data_version(conn, child_id)
+    finally:
+        conn.close()
+    
+    assessment = get_risk_assessment(milestones, child_dict['total_months'])
+    
+    with app.app_context():
+        return render_template('report.html',
+                               child=child_dict,
+                               milestones=milestones,
+                               vaccinations=vaccinations,
+                               growth=growth,
+                               alerts=alerts,
+                               assessment=assessment,
+                               data_version=data_version,
+                               today=date.today(),
+                               generated_at=datetime.now().strftime('%Y-%m-%d %H:%M'))
+
+@app.route('/api/child/<int:child_id>/report', methods=['GET'])
+def api_get_child_report(child_id):
+    """
+    Printable health report (self-contained HTML, ready to print to PDF)
+    
+    Served from the cache when the child's data has not changed; otherwise
+    generation is queued and 202 is returned (or ?wait=1 blocks for it).
+    """
+    conn = get_child_db(child_id)
+    child = conn.execute('SELECT id FROM children WHERE id = ?', (child_id,)).fetchone()
+    data_version = reports.get_data_version(conn, child_id) if child else None
+    conn.close()
+    
+    if not child:
+        return jsonify({'error': 'Child not found'}), 404
+    
+    key = reports.report_key(child_id, data_version)
+    path = reports.get_cached_report(child_id, key)
+    
+    if path is None:
+        future = reports.request_report(child_id, key, lambda: build_child_report(child_id))
+        if not request.args.get('wait'):
+            response = jsonify({'status': 'generating', 'child_id': child_id})
+            response.headers['Retry-After'] = '2'
+            return response, 202
+        try:
+            path = future.result(timeout=30)
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    response = send_file(os.path.abspath(path), mimetype='text/html', etag=key, conditional=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# ----- CONSULTATION BOOKING -----
+
+@app.route('/api/consultation/slots', methods=['GET'])
+def api_get_consultation_slots():
+    """Free consultation slots for ?date= (default today) over ?days= days, optionally per ?doctor_id="""
+    try:
+        start_date = date.fromisoformat(request.args.get('date', str(date.today())))
+    except ValueError:
+        return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+    days = request.args.get('days', 1, type=int)
+    doctor_ids = request.args.getlist('doctor_id', type=int)
+    
+    conn = get_db()
+    try:
+        doctors = scheduling.get_free_slots(conn, start_date, days, doctor_ids)
+    finally:
+        conn.close()
+    
+    return jsonify({'date': str(start_date), 'days': min(max(days, 1), scheduling.MAX_DAYS),
+                    'doctors': doctors})
+
+@app.route('/api/consultation/book', methods=['POST'])
+def api_book_consultation():
+    """Book a consultation slot (doctor_id, slot_start "YYYY-MM-DD HH:MM", child_id, concern)"""
+    if request.is_json:
+        data = request.get_json()
+    else:
+        data = request.form
+    
+    try:
+        doctor_id = int(data['doctor_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'doctor_id is required'}), 400
+    
+    conn = get_db()
+    conn.isolation_level = None
+    
+    try:
+        # IMMEDIATE takes the write lock up front, so the overlap check and
+        # the insert cannot interleave with another booking
+        conn.execute('BEGIN IMMEDIATE')
+        booking_id = scheduling.book_slot(conn, doctor_id, data.get('slot_start'),
+                                          data.get('child_id') or None, data.get('concern', ''))
+        conn.execute('COMMIT')
+    except scheduling.SlotTakenError as e:
+        conn.execute('ROLLBACK')
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    except scheduling.BookingError as e:
+        conn.execute('ROLLBACK')
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        conn.close()
+    
+    return jsonify({'status': 'success', 'booking_id': booking_id,
+                    'doctor_id': doctor_id, 'slot_start': data.get('slot_start')}), 201
+
+# ----- POPULATION ANALYTICS -----
+
+@app.route('/api/analytics/milestones', methods=['GET'])
+def api_get_milestone_analytics():
+    """
+    Milestone achievement rates from the rollup, per milestone and against its WHO bands
+
+    Filters: ?category=, ?milestone_name=, ?gender=, ?age_from=, ?age_to=;
+    ?group_by= any of age_months, gender (default both). Scoped to the
+    requesting clinic, or all clinics.
+    """
+    shards = get_request_shards()
+    
+    group_by = tuple(request.args.get('group_by', 'age_months,gender').split(','))
+    if not set(group_by) <= {'age_months', 'gender'}:
+        return jsonify({'error': 'group_by must be age_months and/or gender'}), 400
+    filters = {
+        'category': request.args.get('category'),
+        'milestone_name': request.args.get('milestone_name'),
+        'gender': request.args.get('gender'),
+        'age_from': request.args.get('age_from', type=int),
+        'age_to': request.args.get('age_to', type=int),
+    }
+    
+    def collect(shard):
+        conn = shard_router.connect(shard)
+        try:
+            return analytics.query_rollup(conn, **filters)
+        finally:
+            conn.close()
+    
+    rows = [row for shard_rows in shard_router.fan_out(collect, shards) for row in shard_rows]
+    return jsonify({
+        'clinic': get_request_clinic(),
+        'group_by': list(group_by),
+        'milestones': analytics.summarize(rows, group_by)
+    })
+
 # ===== AI CHATBOT ROUTES =====
 
 @app.route('/chatbot')
@@ -677,11 +1494,24 @@ Type your question and I'll help! 😊"""
 # ===== END OF CHATBOT ROUTES =====
 
 
+# ===== METRICS =====
+
+@app.route('/api/metrics', methods=['GET'])
+def api_get_metrics():
+    """In-process counters, gauges and timings (backups, ...)"""
+    return jsonify(metrics.snapshot())
+
+
+# ===== BACKGROUND JOBS =====
+
+# Online backups every N minutes, e.g. BACKUP_INTERVAL_MINUTES=360
+if os.environ.get("BACKUP_INTERVAL_MINUTES"):
+    backup_db.start_backup_scheduler(float(os.environ["BACKUP_INTERVAL_MINUTES"]))
+
+
 # ===== RUN APP =====
 
 if __name__ == "__main__":
-    import os
-
     port = int(os.environ.get("PORT", 5000))
 
     print("🩺 Starting Growth Guardian Backend...")
@@ -703,8 +1533,21 @@ if __name__ == "__main__":
     print("    POST /api/child           - Add child")
     print("    GET  /api/children        - Get all children")
     print("    POST /api/milestone       - Add milestone")
+    print("    POST /api/child/<id>/milestones/batch - Add a screening checklist")
+    print("    GET  /api/child/<id>/milestones/history - Full milestone history")
     print("    POST /api/vaccination/mark-given - Mark vaccine as given")
     print("    GET  /api/child/<id>/vaccinations - Get vaccinations")
+    print("    GET  /api/child/<id>/catchup - Catch-up dates for overdue doses")
+    print("    GET  /api/catchup         - Catch-up plan for a clinic (paged)")
+    print("    GET  /api/export/<table>  - Export a table (CSV/Parquet)")
+    print("    POST /api/sync            - Bulk offline sync (idempotent)")
+    print("    GET  /api/alerts          - Alerts for all children (fan-out)")
+    print("    GET  /api/child/<id>/report - Printable health report")
+    print("    GET  /api/consultation/slots - Free consultation slots")
+    print("    POST /api/consultation/book - Book a consultation slot")
+    print("    GET  /api/analytics/milestones - Population milestone achievement rates")
+    print("    GET  /api/changes?since=<cursor> - Incremental change feed")
+    print("    GET  /api/metrics         - In-process metrics")
     print("\n")
     
 
@@ -0,0 +1,203 @@
+"""
+Hot/Cold Archival
+Moves children who have aged out of every milestone and vaccine window,
+with all of their rows, from a shard into its archive database
+(<shard>.archive.db) in small resumable batches
+"""
+
+import os
+import re
+import sqlite3
+from datetime import date, timedelta
+
+import shard_router
+from milestone_checker import MILESTONE_STANDARDS
+from vaccine_schedule import LAST_VACCINE_WEEKS
+
+# Oldest milestone window (+6 month buffer, as in get_milestones_for_age)
+LAST_MILESTONE_MONTHS = max(m['max'] for ms in MILESTONE_STANDARDS.values() for m in ms.values()) + 6
+
+# Children with any recorded change this recent stay hot
+ACTIVE_WITHIN_DAYS = 90
+
+BATCH_SIZE = 200
+
+# Per-child tables moved to the archive, children last
+CHILD_TABLES = ['milestone_status', 'milestones', 'vaccinations', 'growth_records']
+
+# Tables created in the archive (schema copied from the shard)
+ARCHIVE_TABLES = ['children', 'milestones', 'vaccinations', 'growth_records',
+                  'milestone_status', 'change_log']
+
+
+def archive_path(db_path):
+    """Archive database file that belongs to a shard database"""
+    stem, ext = os.path.splitext(db_path)
+    return f"{stem}.archive{ext or '.db'}"
+
+
+def get_cutoff_date(today=None):
+    """Children born on or before this date are past every milestone and vaccine"""
+    today = today or date.today()
+    months = LAST_MILESTONE_MONTHS
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    cutoff = date(year, month + 1, min(today.day, 28))
+    return min(cutoff, today - timedelta(weeks=LAST_VACCINE_WEEKS))
+
+
+def open_archive(db_path):
+    """Read-only connection to a shard's archive, or None if there is none"""
+    path = archive_path(db_path)
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def find_archived_child(db_path, child_id):
+    """Archive connection holding child_id, or None (caller closes it)"""
+    conn = open_archive(db_path)
+    if conn is None:
+        return None
+    if conn.execute('SELECT 1 FROM children WHERE id = ?', (child_id,)).fetchone():
+        return conn
+    conn.close()
+    return None
+
+
+def archive_shard(shard, batch_size=BATCH_SIZE, max_batches=None, today=None):
+    """
+    Move inactive children of one shard to its archive
+
+    Each batch is first copied (idempotent INSERT OR REPLACE, committed),
+    then deleted from the hot tables. If the job stops between the two
+    steps, the next run copies the same children again and finishes the
+    delete, so it can be interrupted and resumed at any point.
+
+    Returns: number of children archived
+    """
+    conn = shard_router.connect(shard, timeout=30.0)
+    conn.isolation_level = None
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path(shard.path),))
+    moved = 0
+    batches = 0
+
+    try:
+        _create_archive_schema(conn)
+        cutoff = get_cutoff_date(today)
+
+        while max_batches is None or batches < max_batches:
+            child_ids = [r['id'] for r in conn.execute('''
+                SELECT c.id FROM main.children c
+                WHERE c.date_of_birth <= ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM main.change_log l
+                    WHERE l.child_id = c.id AND l.changed_at >= datetime('now', ?)
+                )
+                ORDER BY c.id
+                LIMIT ?
+            ''', (cutoff.isoformat(), f'-{ACTIVE_WITHIN_DAYS} days', batch_size))]
+            if not child_ids:
+                break
+
+            placeholders = ','.join('?' * len(child_ids))
+
+            # Step 1: copy into the archive
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for table in ['children'] + CHILD_TABLES:
+                    key = 'id' if table == 'children' else 'child_id'
+                    conn.execute(f'''
+                        INSERT OR REPLACE INTO archive.{table}
+                        SELECT * FROM main.{table} WHERE {key} IN ({placeholders})
+                    ''', child_ids)
+                # The change history is copied (not moved) so feed cursors stay intact
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO archive.change_log
+                    SELECT * FROM main.change_log WHERE child_id IN ({placeholders})
+                ''', child_ids)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+            # Step 2: remove from the hot tables (milestone_status first, so the
+            # milestones delete trigger has nothing to recompute)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                last_change = conn.execute('SELECT COALESCE(MAX(id), 0) FROM main.change_log').fetchone()[0]
+                for table in CHILD_TABLES:
+                    conn.execute(f'DELETE FROM main.{table} WHERE child_id IN ({placeholders})', child_ids)
+                conn.execute(f'DELETE FROM main.children WHERE id IN ({placeholders})', child_ids)
+                # The delete triggers logged these rows as deleted, but they are
+                # still served from the archive; feed clients should keep them
+                conn.execute('''
+                    UPDATE main.change_log SET op = 'archive' WHERE id > ? AND op = 'delete'
+                ''', (last_change,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+            moved += len(child_ids)
+            batches += 1
+    finally:
+        conn.close()
+
+    return moved
+
+
+def upgrade_archive_schema(conn, db_path):
+    """Bring an existing archive up to date with the shard's tables (new columns, indexes)"""
+    conn.commit()
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path(db_path),))
+    try:
+        _create_archive_schema(conn)
+        conn.commit()
+    finally:
+        conn.execute('DETACH DATABASE archive')
+
+
+def _create_archive_schema(conn):
+    """Copy table and index definitions (not triggers) from main into the archive"""
+    rows = conn.execute(f'''
+        SELECT type, sql FROM main.sqlite_master
+        WHERE tbl_name IN ({','.join('?' * len(ARCHIVE_TABLES))})
+        AND type IN ('table', 'index') AND sql IS NOT NULL
+    ''', ARCHIVE_TABLES).fetchall()
+
+    def archived(sql):
+        return re.sub(r'^CREATE (TABLE|INDEX|UNIQUE INDEX)\s+(IF NOT EXISTS\s+)?',
+                      lambda m: f"CREATE {m.group(1)} IF NOT EXISTS archive.", sql)
+
+    for row in rows:
+        if row['type'] == 'table':
+            conn.execute(archived(row['sql']))
+    _add_missing_columns(conn)
+    for row in rows:
+        if row['type'] == 'index':
+            conn.execute(archived(row['sql']))
+
+
+def _add_missing_columns(conn):
+    """Columns added to a shard table after its archive was created (rows are copied with SELECT *)"""
+    for table in ARCHIVE_TABLES:
+        archived = {r['name'] for r in conn.execute(f'PRAGMA archive.table_info({table})')}
+        for column in conn.execute(f'PRAGMA main.table_info({table})').fetchall():
+            if column['name'] not in archived:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column['name']} {column['type']}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Move aged-out children to the archive databases')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, help='Stop after this many batches per shard')
+    args = parser.parse_args()
+
+    print(f"Archiving children born on or before {get_cutoff_date()}...")
+    for shard in shard_router.all_shards():
+        moved = archive_shard(shard, args.batch_size, args.max_batches)
+        print(f"✓ {shard.clinic}: {moved} children moved to {archive_path(shard.path)}")
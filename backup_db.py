@@ -0,0 +1,230 @@
+"""
+Online Backup & Restore
+Copies the live database with SQLite's online backup API in small page
+steps, sleeping between steps so app writers are never stalled for long
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import archive
+import metrics
+import shard_router
+
+DATABASE = 'database.db'
+BACKUP_DIR = 'backups'
+
+# Pages copied per backup step and pause between steps (seconds)
+PAGES_PER_STEP = 64
+STEP_SLEEP = 0.02
+
+# Number of backup files kept by the scheduler
+KEEP_BACKUPS = 7
+
+# Tables a restorable backup must contain
+REQUIRED_TABLES = {'children', 'milestones', 'vaccinations', 'growth_records'}
+
+
+def backup_database(dest_path=None, db_path=DATABASE,
+                    pages=PAGES_PER_STEP, step_sleep=STEP_SLEEP):
+    """
+    Take a consistent online backup of db_path
+
+    The copy is written to a temporary file, checked with
+    PRAGMA integrity_check and only then renamed into place.
+
+    Returns: dict with path, pages, bytes, duration_seconds, restarts
+    """
+    if dest_path is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        dest_path = os.path.join(BACKUP_DIR, f"{_backup_prefix(db_path)}-{stamp}.db")
+    tmp_path = dest_path + '.partial'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    progress = {'total': 0, 'restarts': 0, 'last_remaining': None}
+
+    def on_step(status, remaining, total):
+        # Without a pinned snapshot, a write from another connection
+        # restarts the copy from page one
+        if progress['last_remaining'] is not None and remaining > progress['last_remaining']:
+            progress['restarts'] += 1
+        progress['last_remaining'] = remaining
+        progress['total'] = total
+        # Source locks are released between steps, so writers get in here
+        if remaining:
+            time.sleep(step_sleep)
+
+    source = sqlite3.connect(db_path, timeout=10.0)
+    target = sqlite3.connect(tmp_path)
+    start = time.monotonic()
+
+    try:
+        # In WAL mode, pin a read snapshot for the whole copy: writers keep
+        # committing to the WAL and the backup never has to restart
+        if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=pages, progress=on_step)
+        check_integrity(target)
+    except Exception:
+        metrics.increment('backup_failures_total')
+        target.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+
+    page_size = target.execute('PRAGMA page_size').fetchone()[0]
+    target.close()
+    os.replace(tmp_path, dest_path)
+
+    duration = time.monotonic() - start
+    size = progress['total'] * page_size
+    throughput = size / duration if duration > 0 else 0.0
+
+    metrics.increment('backups_total')
+    metrics.increment('backup_restarts_total', progress['restarts'])
+    metrics.observe('backup_duration_seconds', duration)
+    metrics.observe('backup_throughput_bytes_per_second', throughput)
+    metrics.set_gauge('backup_last_bytes', size)
+    metrics.set_gauge('backup_last_completed_at', time.time())
+
+    return {
+        'path': dest_path,
+        'pages': progress['total'],
+        'bytes': size,
+        'duration_seconds': round(duration, 3),
+        'throughput_bytes_per_second': round(throughput),
+        'restarts': progress['restarts']
+    }
+
+
+def restore_database(backup_path, db_path=DATABASE, pages=PAGES_PER_STEP):
+    """
+    Restore db_path from a backup file after verifying it
+
+    The backup is integrity-checked and must contain the app tables before
+    anything is written; the restored database is checked again afterwards.
+    """
+    if not os.path.exists(backup_path):
+        raise FileNotFoundError(f"Backup not found: {backup_path}")
+
+    source = sqlite3.connect(f'file:{backup_path}?mode=ro', uri=True)
+    try:
+        check_integrity(source)
+        tables = {r[0] for r in source.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = REQUIRED_TABLES - tables
+        if missing:
+            raise ValueError(f"Backup is missing tables: {', '.join(sorted(missing))}")
+
+        target = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            source.backup(target, pages=pages)
+            check_integrity(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+    metrics.increment('restores_total')
+    return {'path': db_path, 'restored_from': backup_path}
+
+
+def _backup_prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def check_integrity(conn):
+    """Raise ValueError unless PRAGMA integrity_check reports ok"""
+    result = conn.execute('PRAGMA integrity_check').fetchall()
+    if [r[0] for r in result] != ['ok']:
+        raise ValueError(f"Integrity check failed: {result[0][0]}")
+
+
+def shard_databases(shard):
+    """Database files holding a shard's data: the shard itself and its archive, if any"""
+    paths = [shard.path]
+    if os.path.exists(archive.archive_path(shard.path)):
+        paths.append(archive.archive_path(shard.path))
+    return paths
+
+
+def backup_all_shards():
+    """Back up every clinic shard and archive, one at a time to keep I/O gentle"""
+    return [backup_database(db_path=path)
+            for shard in shard_router.all_shards() for path in shard_databases(shard)]
+
+
+def prune_backups(db_path=DATABASE, keep=KEEP_BACKUPS, backup_dir=BACKUP_DIR):
+    """Delete all but the newest `keep` backup files of one database"""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = _backup_prefix(db_path) + '-'
+    files = sorted(f for f in os.listdir(backup_dir)
+                   if f.startswith(prefix) and f.endswith('.db'))
+    removed = files[:-keep] if keep else files
+    for name in removed:
+        os.remove(os.path.join(backup_dir, name))
+    return removed
+
+
+def start_backup_scheduler(interval_minutes):
+    """Back up every shard each interval_minutes on a daemon thread"""
+
+    def run():
+        while True:
+            time.sleep(interval_minutes * 60)
+            for shard in shard_router.all_shards():
+                for path in shard_databases(shard):
+                    try:
+                        result = backup_database(db_path=path)
+                        prune_backups(path)
+                        print(f"✓ Backup written to {result['path']} in {result['duration_seconds']}s")
+                    except Exception as e:
+                        print(f"Error: backup of {path} failed: {e}")
+
+    thread = threading.Thread(target=run, name='backup-scheduler', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Back up or restore the Growth Guardian database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help='Take an online backup')
+    backup_parser.add_argument('--dest', help='Backup file path (default: backups/<db>-<time>.db)')
+    backup_parser.add_argument('--db', help='Back up one database file instead of every clinic shard')
+
+    restore_parser = subparsers.add_parser('restore', help='Restore from a verified backup')
+    restore_parser.add_argument('backup_path')
+    restore_parser.add_argument('--clinic', help='Clinic whose shard is restored (default: default)')
+    restore_parser.add_argument('--archive', action='store_true',
+                                help="Restore the clinic's archive database instead of the shard")
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        if args.db:
+            results = [backup_database(args.dest, args.db)]
+        else:
+            results = backup_all_shards()
+        for result in results:
+            print(f"✅ Backup written to {result['path']}")
+            print(f"   {result['bytes']} bytes in {result['duration_seconds']}s "
+                  f"({result['throughput_bytes_per_second']} bytes/s, {result['restarts']} restarts)")
+    else:
+        db_path = shard_router.get_shard(args.clinic).path
+        if args.archive:
+            db_path = archive.archive_path(db_path)
+        restore_database(args.backup_path, db_path)
+        print(f"✅ {db_path} restored from {args.backup_path}")
@@ -0,0 +1,263 @@
+"""
+Vaccination Catch-up Planner
+Proposes the earliest valid date for every overdue dose (and the doses of
+the same series that have to move with it), respecting the minimum age
+and the minimum interval between doses of each series
+"""
+
+import time
+from datetime import date, timedelta
+from itertools import groupby
+
+import shard_router
+from vaccine_schedule import VACCINE_SCHEDULE
+
+# Catch-up rules per series: minimum age for the first dose, minimum
+# interval before each following dose, and age limits (weeks)
+CATCHUP_RULES = {
+    'DTaP': {'min_age': 6, 'intervals': [4, 4, 26], 'max_age': 364},
+    'IPV': {'min_age': 6, 'intervals': [4, 4, 26], 'max_age': None},
+    'Hib': {'min_age': 6, 'intervals': [4, 4], 'max_age': 260},
+    'Rotavirus': {'min_age': 6, 'intervals': [4, 4], 'max_age': 35, 'max_first_dose_age': 15},
+    'Hepatitis B': {'min_age': 0, 'intervals': [4, 8], 'max_age': None},
+    'MMR': {'min_age': 36, 'intervals': [4], 'max_age': None},
+}
+
+# Vaccination rows updated per write transaction, and the pause between
+# transactions that lets app writers take the lock
+WRITE_BATCH = 2000
+WRITE_PAUSE = 0.02
+
+
+def get_series(vaccine_name):
+    """Series a dose belongs to ("DTaP - 2nd dose" -> "DTaP"), or None"""
+    series = vaccine_name.split(' - ')[0].replace(' Booster', '')
+    return series if series in CATCHUP_RULES else None
+
+
+def _build_dose_rules():
+    """(series, position, min_age_days, min_interval_days) for every dose in VACCINE_SCHEDULE"""
+    rules = {}
+    positions = {}
+    for vaccine_name, _ in VACCINE_SCHEDULE:
+        series = get_series(vaccine_name)
+        if series is None:
+            continue
+        position = positions.get(series, 0)
+        positions[series] = position + 1
+        series_rules = CATCHUP_RULES[series]
+        interval = series_rules['intervals'][position - 1] if position else 0
+        rules[vaccine_name] = (series, position, series_rules['min_age'] * 7, interval * 7)
+    return rules
+
+
+# Precomputed once; the planner only does dictionary lookups per dose
+DOSE_RULES = _build_dose_rules()
+
+
+def plan_series(date_of_birth, doses, today):
+    """
+    Catch-up dates for one child's doses of one series
+
+    doses: rows (id, vaccine_name, due_date, given_date, status, catchup_date,
+    catchup_note) of a single series. Nothing changes unless a dose is
+    overdue; then every pending dose gets the later of its due date and the
+    earliest valid date. A date planned earlier is kept for as long as it
+    still meets the interval and age rules (once it has passed, the dose is
+    simply due now), so nightly runs leave settled plans alone; a dose given
+    since the last plan re-plans the whole series. A given dose with an
+    unreadable date blocks the rest of the series with a note.
+
+    Returns: list of (catchup_date, catchup_note, vaccination_id)
+    """
+    doses = sorted(doses, key=lambda d: DOSE_RULES[d['vaccine_name']][1])
+    today_text = today.isoformat()
+    if not any(d['status'] == 'pending' and d['due_date'] < today_text for d in doses):
+        return []
+
+    series = DOSE_RULES[doses[0]['vaccine_name']][0]
+    rules = CATCHUP_RULES[series]
+    max_age = rules['max_age'] and date_of_birth + timedelta(weeks=rules['max_age'])
+    max_first = rules.get('max_first_dose_age') and date_of_birth + timedelta(weeks=rules['max_first_dose_age'])
+    # Given doses keep their plan columns until the next run clears them
+    replan = any(d['status'] != 'pending' and (d['catchup_date'] or d['catchup_note'])
+                 for d in doses)
+
+    plan = []
+    previous = None
+    started = False
+    blocked = None
+    for dose in doses:
+        _, _, min_age_days, interval_days = DOSE_RULES[dose['vaccine_name']]
+        if dose['status'] != 'pending':
+            try:
+                previous = _parse_date(dose['given_date'] or dose['due_date'])
+            except ValueError:
+                blocked = blocked or f"Check the date recorded for {dose['vaccine_name']}"
+            started = True
+            continue
+
+        if not blocked:
+            valid_from = max(_parse_date(dose['due_date']),
+                             date_of_birth + timedelta(days=min_age_days))
+            if previous:
+                valid_from = max(valid_from, previous + timedelta(days=interval_days))
+            earliest = max(today, valid_from)
+            if not replan and dose['catchup_date']:
+                planned = _parse_date(dose['catchup_date'])
+                if planned >= valid_from:
+                    earliest = planned
+            # A planned date that has passed means the dose is due today
+            due_by = max(today, earliest)
+            if max_first and not started and due_by > max_first:
+                blocked = f"Too old to start the {series} series"
+            elif max_age and due_by > max_age:
+                blocked = f"Past the maximum age for {series}"
+
+        # Once a dose cannot be given, neither can the rest of the series
+        if blocked:
+            plan.append((None, blocked, dose['id']))
+        else:
+            plan.append((earliest.isoformat(), None, dose['id']))
+            previous = earliest
+            started = True
+    return plan
+
+
+def compute_plan(conn, today=None, child_ids=None):
+    """
+    Plan every overdue child of a shard (or only child_ids) in a single pass
+
+    Reads the catch-up series of all children with an overdue dose in one
+    query ordered by child, and plans each (child, series) group in turn.
+
+    Returns: list of (catchup_date, catchup_note, vaccination_id)
+    """
+    today = today or date.today()
+    names = list(DOSE_RULES)
+    placeholders = ','.join('?' * len(names))
+    # With child_ids both the outer query and the subquery are limited to
+    # those children, so the lookup uses idx_vaccinations_child
+    scope, scope_params = '', []
+    if child_ids is not None:
+        scope = f"AND child_id IN ({','.join('?' * len(child_ids))})"
+        scope_params = list(child_ids)
+    query = f'''
+        SELECT v.id, v.child_id, v.vaccine_name, v.due_date, v.given_date, v.status,
+               v.catchup_date, v.catchup_note, c.date_of_birth
+        FROM vaccinations v
+        JOIN children c ON c.id = v.child_id
+        WHERE v.vaccine_name IN ({placeholders})
+        AND v.child_id IN (
+            SELECT child_id FROM vaccinations
+            WHERE status = 'pending' AND due_date < ? AND vaccine_name IN ({placeholders})
+            {scope}
+        )
+        ORDER BY v.child_id
+    '''
+    params = names + [today.isoformat()] + names + scope_params
+
+    plan = []
+    for _, rows in groupby(conn.execute(query, params), key=lambda r: r['child_id']):
+        rows = list(rows)
+        try:
+            date_of_birth = _parse_date(rows[0]['date_of_birth'])
+        except ValueError:
+            continue
+        by_series = {}
+        for row in rows:
+            by_series.setdefault(DOSE_RULES[row['vaccine_name']][0], []).append(row)
+        for doses in by_series.values():
+            plan.extend(plan_series(date_of_birth, doses, today))
+    return plan
+
+
+def write_plan(conn, plan, child_ids=None):
+    """
+    Store a plan in bulk and clear catch-up dates that are no longer planned
+
+    The plan is staged in a temp table and applied with set-based UPDATEs,
+    WRITE_BATCH rows per transaction, so app writers are never blocked for
+    long. Rows whose values do not change are not touched (and add nothing
+    to the change log).
+
+    Returns: number of vaccination rows changed
+    """
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS catchup_plan (
+            id INTEGER PRIMARY KEY,
+            catchup_date DATE,
+            catchup_note TEXT
+        )
+    ''')
+    conn.execute('DELETE FROM temp.catchup_plan')
+    conn.executemany('''
+        INSERT INTO temp.catchup_plan (catchup_date, catchup_note, id) VALUES (?, ?, ?)
+    ''', plan)
+    conn.commit()
+
+    changed = 0
+    ids = [r[0] for r in conn.execute('SELECT id FROM temp.catchup_plan ORDER BY id')]
+    try:
+        for start in range(0, len(ids), WRITE_BATCH):
+            batch = ids[start:start + WRITE_BATCH]
+            changed += conn.execute('''
+                UPDATE vaccinations
+                SET catchup_date = p.catchup_date, catchup_note = p.catchup_note
+                FROM temp.catchup_plan p
+                WHERE p.id = vaccinations.id AND p.id BETWEEN ? AND ?
+                AND (vaccinations.catchup_date IS NOT p.catchup_date
+                     OR vaccinations.catchup_note IS NOT p.catchup_note)
+            ''', (batch[0], batch[-1])).rowcount
+            conn.commit()
+            time.sleep(WRITE_PAUSE)
+
+        scope, params = '', []
+        if child_ids is not None:
+            scope = f"AND child_id IN ({','.join('?' * len(child_ids))})"
+            params = list(child_ids)
+        changed += conn.execute(f'''
+            UPDATE vaccinations SET catchup_date = NULL, catchup_note = NULL
+            WHERE (catchup_date IS NOT NULL OR catchup_note IS NOT NULL)
+            AND id NOT IN (SELECT id FROM temp.catchup_plan) {scope}
+        ''', params).rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return changed
+
+
+def plan_children(conn, child_ids, today=None):
+    """Re-plan some children after their vaccinations changed; commits"""
+    child_ids = list(child_ids)
+    if not child_ids:
+        return 0
+    return write_plan(conn, compute_plan(conn, today, child_ids), child_ids)
+
+
+def plan_shard(shard, today=None):
+    """
+    Plan every overdue child of one shard
+
+    Returns: (doses planned, vaccination rows changed)
+    """
+    conn = shard_router.connect(shard, timeout=30.0)
+    try:
+        plan = compute_plan(conn, today)
+        return len(plan), write_plan(conn, plan)
+    finally:
+        conn.close()
+
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+
+if __name__ == '__main__':
+    print("Planning vaccination catch-up dates...")
+    for shard in shard_router.all_shards():
+        planned, changed = plan_shard(shard)
+        print(f"✓ {shard.clinic}: {planned} doses planned, {changed} rows updated")
@@ -0,0 +1,169 @@
+"""
+Change Feed
+Reads the trigger-maintained change_log so clients can sync only the rows
+that changed since their last cursor instead of refetching everything
+"""
+
+import json
+import time
+
+# Tables tracked by the change_log triggers (see init_db.py)
+CHANGE_TABLES = ['children', 'milestones', 'vaccinations', 'growth_records']
+
+# Most changes returned in one response
+MAX_BATCH = 500
+
+# Long-poll and server-sent-events timing (seconds)
+POLL_INTERVAL = 0.5
+MAX_LONG_POLL = 30
+SSE_HEARTBEAT = 15
+SSE_MAX_DURATION = 300
+
+
+class CursorExpiredError(Exception):
+    """The cursor points at changes that have already been pruned"""
+
+
+def get_latest_cursor(conn):
+    """Id of the newest change (0 if the log is empty)"""
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?',
+                       ('change_log',)).fetchone()
+    return row[0] if row else 0
+
+
+def fetch_changes(conn, since=0, limit=MAX_BATCH, child_id=None):
+    """
+    Changes after cursor `since`, each with the row's current contents
+
+    Deleted rows (or rows changed again and since deleted) come back with
+    row = None, as do rows moved to the archive (op = 'archive'), which
+    stay readable through the child endpoints. Raises CursorExpiredError if `since` predates the log.
+
+    Returns: (changes, next_cursor)
+    """
+    limit = min(max(int(limit), 1), MAX_BATCH)
+    check_cursor(conn, since)
+
+    if child_id is None:
+        log = conn.execute('''
+            SELECT * FROM change_log WHERE id > ? ORDER BY id LIMIT ?
+        ''', (since, limit)).fetchall()
+    else:
+        log = conn.execute('''
+            SELECT * FROM change_log WHERE child_id = ? AND id > ? ORDER BY id LIMIT ?
+        ''', (child_id, since, limit)).fetchall()
+
+    if not log:
+        return [], since
+
+    # One query per table for the current state of every touched row
+    current = {}
+    for table in CHANGE_TABLES:
+        ids = sorted({c['row_id'] for c in log if c['table_name'] == table and c['op'] not in ('delete', 'archive')})
+        if not ids:
+            continue
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(f'SELECT * FROM {table} WHERE id IN ({placeholders})', ids).fetchall()
+        current[table] = {r['id']: dict(r) for r in rows}
+
+    changes = []
+    for c in log:
+        changes.append({
+            'cursor': c['id'],
+            'table': c['table_name'],
+            'op': c['op'],
+            'row_id': c['row_id'],
+            'child_id': c['child_id'],
+            'changed_at': c['changed_at'],
+            'row': current.get(c['table_name'], {}).get(c['row_id'])
+        })
+
+    return changes, log[-1]['id']
+
+
+def wait_for_changes(connect, since=0, timeout=MAX_LONG_POLL, limit=MAX_BATCH, child_id=None):
+    """
+    Long-poll: block until there are changes after `since` or timeout expires
+
+    `connect` opens a fresh connection; each poll uses a short read so the
+    long wait never holds a database lock.
+    """
+    deadline = time.monotonic() + min(timeout, MAX_LONG_POLL)
+    while True:
+        conn = connect()
+        try:
+            changes, cursor = fetch_changes(conn, since, limit, child_id)
+        finally:
+            conn.close()
+        if changes or time.monotonic() >= deadline:
+            return changes, cursor
+        time.sleep(POLL_INTERVAL)
+
+
+def stream_changes(connect, since=0, child_id=None, max_duration=None):
+    """
+    Server-sent events: yield one `change` event per change as it appears
+
+    The stream ends after max_duration; clients reconnect with the
+    Last-Event-ID header set to the last cursor they saw.
+    """
+    if max_duration is None:
+        max_duration = SSE_MAX_DURATION
+    cursor = since
+    started = last_sent = time.monotonic()
+    yield 'retry: 2000\n\n'
+
+    while time.monotonic() - started < max_duration:
+        conn = connect()
+        try:
+            changes, cursor = fetch_changes(conn, cursor, MAX_BATCH, child_id)
+        except CursorExpiredError:
+            yield 'event: reset\ndata: {}\n\n'
+            return
+        finally:
+            conn.close()
+
+        for change in changes:
+            yield f"id: {change['cursor']}\nevent: change\ndata: {json.dumps(change, default=str)}\n\n"
+            last_sent = time.monotonic()
+
+        if not changes:
+            if time.monotonic() - last_sent >= SSE_HEARTBEAT:
+                yield ': heartbeat\n\n'
+                last_sent = time.monotonic()
+            time.sleep(POLL_INTERVAL)
+
+
+def prune_changes(conn, keep_days=30):
+    """Delete changes older than keep_days; clients behind that must full-resync"""
+    cursor = conn.execute('''
+        DELETE FROM change_log WHERE changed_at < datetime('now', ?)
+    ''', (f'-{int(keep_days)} days',))
+    conn.commit()
+    return cursor.rowcount
+
+
+def check_cursor(conn, since):
+    """Raise CursorExpiredError if changes after `since` have been pruned"""
+    if since <= 0:
+        return
+    oldest = conn.execute('SELECT MIN(id) FROM change_log').fetchone()[0]
+    if oldest is None:
+        oldest = get_latest_cursor(conn) + 1
+    if since < oldest - 1:
+        raise CursorExpiredError(since)
+
+
+if __name__ == '__main__':
+    import argparse
+    import shard_router
+
+    parser = argparse.ArgumentParser(description='Prune old change feed entries')
+    parser.add_argument('--keep-days', type=int, default=30)
+    args = parser.parse_args()
+
+    for shard in shard_router.all_shards():
+        conn = shard_router.connect(shard)
+        removed = prune_changes(conn, args.keep_days)
+        conn.close()
+        print(f"✓ {shard.clinic}: pruned {removed} changes")
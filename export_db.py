@@ -0,0 +1,311 @@
+"""
+Table Export for Analytics
+Streams every table to CSV or Parquet in constant memory, either in full
+or incrementally: only the rows inserted or updated since a change_log
+cursor (the high-water mark of the previous run)
+"""
+
+import csv
+import io
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import archive
+import change_feed
+import shard_router
+
+DATABASE = 'database.db'
+
+# Tables that can be exported, in dependency order
+EXPORT_TABLES = ['children', 'milestones', 'vaccinations', 'growth_records']
+
+# Rows pulled from SQLite per fetchmany() call
+FETCH_SIZE = 1000
+
+# Remembers the change_log cursor per table for incremental runs
+STATE_FILE = 'export_cursors.json'
+
+
+def open_export_connection(db_path=DATABASE):
+    """Open a read-only connection so an export can never take a write lock"""
+    return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10.0)
+
+
+def get_high_water_mark(conn):
+    """Newest change_log cursor (0 if nothing has changed yet)"""
+    return change_feed.get_latest_cursor(conn)
+
+
+def iter_batches(conn, table, since=0, until=None, fetch_size=FETCH_SIZE):
+    """
+    Yield (columns, rows) batches of the rows to export
+
+    since = 0 exports every row; otherwise only rows inserted or updated by
+    changes since < cursor <= until, in their current state. Only one batch
+    is held in memory at a time.
+    """
+    _check_table(table)
+    if until is None:
+        until = get_high_water_mark(conn)
+
+    source, params = _select_rows(table, since, until)
+    cursor = conn.execute(f'SELECT * {source} ORDER BY id', params)
+    columns = [c[0] for c in cursor.description]
+
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        yield columns, rows
+
+
+def iter_csv(conn, table, since=0, until=None):
+    """Yield CSV text chunks (header first, then one chunk per batch)"""
+    _check_table(table)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    cursor = conn.execute(f'SELECT * FROM {table} LIMIT 0')
+    writer.writerow([c[0] for c in cursor.description])
+    yield _drain(buffer)
+
+    for _, rows in iter_batches(conn, table, since, until):
+        writer.writerows(rows)
+        yield _drain(buffer)
+
+
+def iter_parquet(conn, table, since=0, until=None):
+    """Yield Parquet bytes, one row group per batch"""
+    _check_table(table)
+    pa, pq = import_pyarrow()
+    schema = _arrow_schema(conn, table, pa)
+    sink = _ChunkSink()
+
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for columns, rows in iter_batches(conn, table, since, until):
+            arrays = [pa.array([r[i] for r in rows], type=schema.field(name).type)
+                      for i, name in enumerate(columns)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_table(conn, table, path, fmt='csv', since=0, until=None):
+    """Write one table to a file and return the number of rows written"""
+    if until is None:
+        until = get_high_water_mark(conn)
+
+    if fmt == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            for chunk in iter_csv(conn, table, since, until):
+                f.write(chunk)
+    elif fmt == 'parquet':
+        with open(path, 'wb') as f:
+            for chunk in iter_parquet(conn, table, since, until):
+                f.write(chunk)
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    return _count_rows(conn, table, since, until)
+
+
+def export_all(out_dir, fmt='csv', incremental=False, db_path=DATABASE):
+    """
+    Export every table into out_dir
+
+    In incremental mode only rows inserted or updated since the previous
+    run are written (a row changed several times is written once, as it is
+    now), and the change_log cursor per table is saved in
+    out_dir/export_cursors.json. If the changes since that cursor have been
+    pruned, the table is exported in full again. Deleted rows are not
+    exported; /api/changes reports them.
+
+    Returns: dict of table -> {file, rows, since, high_water_mark}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    state_path = os.path.join(out_dir, STATE_FILE)
+    state = load_state(state_path) if incremental else {}
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+
+    conn = open_export_connection(db_path)
+    results = {}
+    try:
+        for table in EXPORT_TABLES:
+            since = state.get(table, 0)
+            until = get_high_water_mark(conn)
+            try:
+                change_feed.check_cursor(conn, since)
+            except change_feed.CursorExpiredError:
+                since = 0
+
+            if incremental:
+                filename = f"{table}_{stamp}.{fmt}"
+            else:
+                filename = f"{table}.{fmt}"
+            path = os.path.join(out_dir, filename)
+
+            rows = export_table(conn, table, path, fmt, since, until)
+            state[table] = until
+            results[table] = {
+                'file': path,
+                'rows': rows,
+                'since': since,
+                'high_water_mark': until
+            }
+    finally:
+        conn.close()
+
+    save_state(state_path, state)
+    return results
+
+
+def export_all_shards(out_dir, fmt='csv', incremental=False):
+    """
+    Export every clinic's shard in parallel, one subdirectory per clinic
+
+    A shard's archive database, if any, goes to <clinic>/archive. It is
+    always exported in full: rows arrive there by archival, which its
+    change_log does not record.
+
+    Returns: dict of clinic (or "<clinic>/archive") -> export_all() result
+    """
+    def export_shard(shard):
+        clinic_dir = os.path.join(out_dir, shard.clinic)
+        results = {shard.clinic: export_all(clinic_dir, fmt, incremental, shard.path)}
+        archive_db = archive.archive_path(shard.path)
+        if os.path.exists(archive_db):
+            results[f"{shard.clinic}/archive"] = export_all(
+                os.path.join(clinic_dir, 'archive'), fmt, False, archive_db)
+        return results
+
+    exports = {}
+    for results in shard_router.fan_out(export_shard):
+        exports.update(results)
+    return exports
+
+
+def load_state(path):
+    """Read saved change cursors (empty dict on first run)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    """Atomically write change cursors"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ===== HELPERS =====
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back in chunks"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _drain(buffer):
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
+
+
+def _check_table(table):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+
+
+def _select_rows(table, since, until):
+    """FROM/WHERE clause and params selecting the rows to export"""
+    if not since:
+        return f'FROM {table}', []
+    return f'''
+        FROM {table} WHERE id IN (
+            SELECT row_id FROM change_log
+            WHERE table_name = ? AND op IN ('insert', 'update') AND id > ? AND id <= ?
+        )
+    ''', [table, since, until]
+
+
+def _count_rows(conn, table, since, until):
+    source, params = _select_rows(table, since, until)
+    return conn.execute(f'SELECT COUNT(*) {source}', params).fetchone()[0]
+
+
+def _arrow_schema(conn, table, pa):
+    """Map declared SQLite column types onto an Arrow schema"""
+    _check_table(table)
+    fields = []
+    for col in conn.execute(f'PRAGMA table_info({table})'):
+        declared = (col[2] or '').upper()
+        if 'INT' in declared or declared == 'BOOLEAN':
+            arrow_type = pa.int64()
+        elif declared in ('FLOAT', 'REAL', 'DOUBLE'):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(col[1], arrow_type))
+    return pa.schema(fields)
+
+
+def import_pyarrow():
+    """Import pyarrow lazily since it is only needed for Parquet exports"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export Growth Guardian tables')
+    parser.add_argument('out_dir', help='Directory to write export files into')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only export rows inserted or updated since the last incremental run')
+    parser.add_argument('--db', help='Export one database file instead of every clinic shard')
+    args = parser.parse_args()
+
+    print(f"Exporting tables to {args.out_dir} ({args.format})...")
+    if args.db:
+        exports = {args.db: export_all(args.out_dir, args.format, args.incremental, args.db)}
+    else:
+        exports = export_all_shards(args.out_dir, args.format, args.incremental)
+
+    for source, tables in exports.items():
+        print(f"\n🏥 {source}")
+        for table, info in tables.items():
+            print(f"✓ {table}: {info['rows']} rows (changes {info['since']}..{info['high_water_mark']})")
@@ -1,12 +1,22 @@
+import os
 import sqlite3
+import shard_router
+import scheduling
+import analytics
+import archive
 
-def init_database():
+def init_database(db_path='database.db', shard_index=0):
     """Initialize the database with all required tables"""
     
     # Connect to database (creates it if doesn't exist)
-    conn = sqlite3.connect('database.db')
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # WAL lets long reads (exports, backups) run without blocking writers
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     print("Creating database tables...")
     
     # 1. CHILDREN TABLE
@@ -66,11 +76,218 @@ def init_database():
     ''')
     print("✓ Growth records table created")
     
+    # 5. CHANGE LOG (append-only feed behind /api/changes)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            child_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_change_log_child ON change_log (child_id, id)
+    ''')
+    
+    # Every write to the four data tables appends one change_log row
+    for table, child_column in [('children', 'id'), ('milestones', 'child_id'),
+                                ('vaccinations', 'child_id'), ('growth_records', 'child_id')]:
+        for op, ref in [('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')]:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_log
+                AFTER {op.upper()} ON {table}
+                BEGIN
+                    INSERT INTO change_log (table_name, row_id, child_id, op)
+                    VALUES ('{table}', {ref}.id, {ref}.{child_column}, '{op}');
+                END
+            ''')
+    print("✓ Change log table and triggers created")
+    
+    # 6. SYNC KEYS (idempotency keys of applied offline operations)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            op_type TEXT NOT NULL,
+            row_id INTEGER,
+            applied_at DATETIME NOT NULL
+        )
+    ''')
+    print("✓ Sync keys table created")
+    
+    # 7. MILESTONE STATUS (latest result per child and milestone)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS milestone_status (
+            child_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            milestone_name TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            age_months INTEGER NOT NULL,
+            achieved BOOLEAN NOT NULL,
+            date_recorded DATE NOT NULL,
+            risk_level TEXT,
+            PRIMARY KEY (child_id, category, milestone_name),
+            FOREIGN KEY (child_id) REFERENCES children(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_milestones_child ON milestones (child_id, date_recorded)
+    ''')
+    
+    # Every new milestone row replaces the status unless it is older (offline sync)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_milestones_insert_status
+        AFTER INSERT ON milestones
+        BEGIN
+            INSERT INTO milestone_status
+                (child_id, category, milestone_name, id, age_months, achieved, date_recorded, risk_level)
+            VALUES (NEW.child_id, NEW.category, NEW.milestone_name, NEW.id,
+                    NEW.age_months, NEW.achieved, NEW.date_recorded, NEW.risk_level)
+            ON CONFLICT (child_id, category, milestone_name) DO UPDATE SET
+                id = excluded.id,
+                age_months = excluded.age_months,
+                achieved = excluded.achieved,
+                date_recorded = excluded.date_recorded,
+                risk_level = excluded.risk_level
+            WHERE excluded.date_recorded >= milestone_status.date_recorded;
+        END
+    ''')
+    
+    # Deleting the current row falls back to the newest remaining one
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_milestones_delete_status
+        AFTER DELETE ON milestones
+        WHEN EXISTS (SELECT 1 FROM milestone_status WHERE id = OLD.id)
+        BEGIN
+            DELETE FROM milestone_status WHERE id = OLD.id;
+            INSERT INTO milestone_status
+                (child_id, category, milestone_name, id, age_months, achieved, date_recorded, risk_level)
+            SELECT child_id, category, milestone_name, id, age_months, achieved, date_recorded, risk_level
+            FROM milestones
+            WHERE child_id = OLD.child_id AND category = OLD.category
+              AND milestone_name = OLD.milestone_name
+            ORDER BY date_recorded DESC, id DESC
+            LIMIT 1;
+        END
+    ''')
+    
+    # Backfill from existing history
+    cursor.execute('''
+        INSERT OR IGNORE INTO milestone_status
+            (child_id, category, milestone_name, id, age_months, achieved, date_recorded, risk_level)
+        SELECT child_id, category, milestone_name, id, age_months, achieved, date_recorded, risk_level
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY child_id, category, milestone_name
+                ORDER BY date_recorded DESC, id DESC
+            ) AS rn
+            FROM milestones
+        )
+        WHERE rn = 1
+    ''')
+    print("✓ Milestone status table created")
+    
+    # 8. CONSULTATION TABLES (doctors, weekly schedules, bookings)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS doctors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            specialty TEXT NOT NULL,
+            fee INTEGER NOT NULL,
+            slot_minutes INTEGER NOT NULL DEFAULT 30
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS doctor_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            FOREIGN KEY (doctor_id) REFERENCES doctors(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_id INTEGER NOT NULL,
+            child_id INTEGER,
+            slot_start DATETIME NOT NULL,
+            slot_end DATETIME NOT NULL,
+            concern TEXT,
+            created_at DATETIME NOT NULL,
+            UNIQUE (doctor_id, slot_start),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings (slot_start)
+    ''')
+    conn.row_factory = sqlite3.Row
+    scheduling.seed_doctors(conn)
+    print("✓ Consultation tables created")
+    
+    # 9. MILESTONE ROLLUP (screened/achieved counts behind /api/analytics/milestones)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS milestone_rollup (
+            category TEXT NOT NULL,
+            milestone_name TEXT NOT NULL,
+            age_months INTEGER NOT NULL,
+            gender TEXT NOT NULL,
+            screened INTEGER NOT NULL DEFAULT 0,
+            achieved INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, milestone_name, age_months, gender)
+        )
+    ''')
+    
+    # Counts only grow: archiving a child must not change population statistics
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_milestones_insert_rollup
+        AFTER INSERT ON milestones
+        BEGIN
+            INSERT INTO milestone_rollup
+                (category, milestone_name, age_months, gender, screened, achieved)
+            VALUES (NEW.category, NEW.milestone_name, NEW.age_months,
+                    COALESCE((SELECT gender FROM children WHERE id = NEW.child_id), 'Unknown'),
+                    1, CASE WHEN NEW.achieved THEN 1 ELSE 0 END)
+            ON CONFLICT (category, milestone_name, age_months, gender) DO UPDATE SET
+                screened = screened + 1,
+                achieved = achieved + excluded.achieved;
+        END
+    ''')
+    
+    # Backfill from existing history
+    if not cursor.execute('SELECT 1 FROM milestone_rollup LIMIT 1').fetchone():
+        analytics.rebuild_rollup(conn, db_path)
+    print("✓ Milestone rollup table created")
+    
+    # 10. VACCINATION CATCH-UP PLAN (columns written by catchup.py)
+    vaccination_columns = [r[1] for r in cursor.execute('PRAGMA table_info(vaccinations)')]
+    for column, column_type in [('catchup_date', 'DATE'), ('catchup_note', 'TEXT')]:
+        if column not in vaccination_columns:
+            cursor.execute(f'ALTER TABLE vaccinations ADD COLUMN {column} {column_type}')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vaccinations_child ON vaccinations (child_id, due_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_vaccinations_catchup ON vaccinations (id)
+        WHERE catchup_date IS NOT NULL OR catchup_note IS NOT NULL
+    ''')
+    if os.path.exists(archive.archive_path(db_path)):
+        archive.upgrade_archive_schema(conn, db_path)
+    print("✓ Vaccination catch-up columns created")
+    
+    # Ids in this shard start at its offset so they never collide with other clinics
+    shard_router.seed_id_range(conn, shard_index)
+    
     conn.commit()
     conn.close()
     
     print("\n✅ Database initialized successfully!")
-    print("Database file: database.db")
+    print(f"Database file: {db_path}")
 
 if __name__ == '__main__':
-    init_database()
+    for shard in shard_router.all_shards():
+        print(f"\n🏥 Clinic: {shard.clinic} (shard {shard.index})")
+        init_database(shard.path, shard.index)
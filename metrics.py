@@ -0,0 +1,45 @@
+"""
+In-process Metrics
+Thread-safe counters, gauges and timings, exported as JSON at /api/metrics
+"""
+
+import threading
+import time
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def increment(name, value=1):
+    """Add to a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """Record the current value of a gauge"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """Record one sample of a timing or size (count, sum, max and last)"""
+    with _lock:
+        stats = _timings.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0, 'last': 0.0})
+        stats['count'] += 1
+        stats['sum'] += value
+        stats['max'] = max(stats['max'], value)
+        stats['last'] = value
+
+
+def snapshot():
+    """Copy of every metric, safe to serialize"""
+    with _lock:
+        return {
+            'timestamp': time.time(),
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': {name: dict(stats) for name, stats in _timings.items()}
+        }
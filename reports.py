@@ -0,0 +1,95 @@
+"""
+Printable Child Health Reports
+Reports are rendered on a small worker pool and cached on disk under a key
+derived from the child's data version, so an unchanged child is served
+straight from the cache and a change produces a new file
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+REPORT_CACHE_DIR = 'report_cache'
+REPORT_WORKERS = 2
+
+# Bump when report.html changes so cached reports are rebuilt
+REPORT_FORMAT_VERSION = 1
+
+_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix='report')
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def get_data_version(conn, child_id):
+    """Latest change_log cursor touching this child (0 if none)"""
+    row = conn.execute('''
+        SELECT COALESCE(MAX(id), 0) FROM change_log WHERE child_id = ?
+    ''', (child_id,)).fetchone()
+    return row[0]
+
+
+def report_key(child_id, data_version, on_date=None):
+    """
+    Cache key for a report
+
+    Ages and overdue counts move with the calendar, so the date is part of
+    the key alongside the data version.
+    """
+    on_date = on_date or date.today()
+    raw = f"{child_id}:{data_version}:{on_date.isoformat()}:{REPORT_FORMAT_VERSION}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def cached_report_path(child_id, key):
+    """Where the report for a key lives on disk"""
+    return os.path.join(REPORT_CACHE_DIR, str(child_id), f"{key}.html")
+
+
+def get_cached_report(child_id, key):
+    """Path of a cached report, or None if it has not been generated"""
+    path = cached_report_path(child_id, key)
+    return path if os.path.exists(path) else None
+
+
+def request_report(child_id, key, build):
+    """
+    Queue generation of a report unless it is cached or already queued
+
+    build() must return the report HTML. Returns the Future for the path.
+    """
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _pool.submit(_generate, child_id, key, build)
+            _pending[key] = future
+            future.add_done_callback(lambda _: _forget(key))
+        return future
+
+
+def _generate(child_id, key, build):
+    path = cached_report_path(child_id, key)
+    if os.path.exists(path):
+        return path
+
+    html = build()
+
+    child_dir = os.path.dirname(path)
+    os.makedirs(child_dir, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(tmp_path, path)
+
+    # Older versions of this child's report are stale now
+    for name in os.listdir(child_dir):
+        if name.endswith('.html') and name != os.path.basename(path):
+            os.remove(os.path.join(child_dir, name))
+
+    return path
+
+
+def _forget(key):
+    with _pending_lock:
+        _pending.pop(key, None)
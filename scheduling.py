@@ -0,0 +1,194 @@
+"""
+Consultation Slot Availability
+Computes free slots for many doctors and days from two range queries
+(schedules and bookings) using a sorted interval index per doctor, and
+books slots with an atomic conditional insert
+"""
+
+import sqlite3
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+SLOT_FORMAT = '%Y-%m-%d %H:%M'
+
+# Longest range /api/consultation/slots will compute in one request
+MAX_DAYS = 31
+
+# Doctors from the consultation page, seeded into an empty table
+# (name, specialty, fee, slot minutes, [(weekday, start, end), ...]); Monday = 0
+DEFAULT_DOCTORS = [
+    ("Dr. Priya Sharma", "Pediatrician & Child Development Specialist", 200, 30,
+     [(d, "10:00", "13:00") for d in range(6)] + [(d, "14:00", "17:00") for d in range(5)]),
+    ("Dr. Rajesh Kumar", "Senior Pediatrician & Neonatologist", 300, 30,
+     [(d, "09:00", "12:00") for d in range(6)] + [(d, "16:00", "19:00") for d in range(5)]),
+    ("Dr. Anita Patel", "Pediatrician & Vaccination Expert", 250, 30,
+     [(d, "11:00", "14:00") for d in range(5)] + [(d, "15:00", "18:00") for d in range(6)]),
+]
+
+
+class BookingError(Exception):
+    """A requested slot cannot be booked (outside schedule or misaligned)"""
+
+
+class SlotTakenError(BookingError):
+    """The slot overlaps an existing booking"""
+
+
+def seed_doctors(conn):
+    """Insert DEFAULT_DOCTORS and their weekly schedules if there are no doctors yet"""
+    if conn.execute('SELECT COUNT(*) FROM doctors').fetchone()[0]:
+        return
+    for name, specialty, fee, slot_minutes, schedule in DEFAULT_DOCTORS:
+        cursor = conn.execute('''
+            INSERT INTO doctors (name, specialty, fee, slot_minutes)
+            VALUES (?, ?, ?, ?)
+        ''', (name, specialty, fee, slot_minutes))
+        conn.executemany('''
+            INSERT INTO doctor_schedules (doctor_id, weekday, start_time, end_time)
+            VALUES (?, ?, ?, ?)
+        ''', [(cursor.lastrowid, weekday, start, end) for weekday, start, end in schedule])
+
+
+def build_booking_index(conn, start, end, doctor_ids=None):
+    """
+    Booked intervals overlapping [start, end), grouped by doctor
+
+    Returns: {doctor_id: (starts, ends)} with both lists sorted by start.
+    Bookings for one doctor never overlap, so ends is sorted too.
+    """
+    query = '''
+        SELECT doctor_id, slot_start, slot_end FROM bookings
+        WHERE slot_start < ? AND slot_end > ?
+    '''
+    params = [end.strftime(SLOT_FORMAT), start.strftime(SLOT_FORMAT)]
+    if doctor_ids:
+        query += f" AND doctor_id IN ({','.join('?' * len(doctor_ids))})"
+        params.extend(doctor_ids)
+    query += ' ORDER BY doctor_id, slot_start'
+
+    index = {}
+    for row in conn.execute(query, params):
+        starts, ends = index.setdefault(row['doctor_id'], ([], []))
+        starts.append(row['slot_start'])
+        ends.append(row['slot_end'])
+    return index
+
+
+def is_free(index_entry, slot_start, slot_end):
+    """True if no booked interval overlaps [slot_start, slot_end) (strings in SLOT_FORMAT)"""
+    if index_entry is None:
+        return True
+    starts, ends = index_entry
+    # Only the last booking starting before slot_end can overlap
+    i = bisect_left(starts, slot_end)
+    return i == 0 or ends[i - 1] <= slot_start
+
+
+def get_free_slots(conn, start_date, days=1, doctor_ids=None, now=None):
+    """
+    Free slots for every (or the given) doctor over `days` days from start_date
+
+    Returns: list of {doctor_id, name, specialty, fee, slots: [{start, end}]}
+    """
+    days = min(max(days, 1), MAX_DAYS)
+    now = now or datetime.now()
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = range_start + timedelta(days=days)
+
+    query = 'SELECT * FROM doctors'
+    params = []
+    if doctor_ids:
+        query += f" WHERE id IN ({','.join('?' * len(doctor_ids))})"
+        params = list(doctor_ids)
+    doctors = conn.execute(query + ' ORDER BY id', params).fetchall()
+
+    schedules = {}
+    for row in conn.execute('SELECT * FROM doctor_schedules ORDER BY doctor_id, weekday, start_time'):
+        schedules.setdefault(row['doctor_id'], []).append(row)
+
+    index = build_booking_index(conn, range_start, range_end, doctor_ids)
+
+    results = []
+    for doctor in doctors:
+        step = timedelta(minutes=doctor['slot_minutes'])
+        slots = []
+        for day_offset in range(days):
+            day = start_date + timedelta(days=day_offset)
+            for window in schedules.get(doctor['id'], []):
+                if window['weekday'] != day.weekday():
+                    continue
+                slot = _at(day, window['start_time'])
+                window_end = _at(day, window['end_time'])
+                while slot + step <= window_end:
+                    slot_start = slot.strftime(SLOT_FORMAT)
+                    slot_end = (slot + step).strftime(SLOT_FORMAT)
+                    if slot > now and is_free(index.get(doctor['id']), slot_start, slot_end):
+                        slots.append({'start': slot_start, 'end': slot_end})
+                    slot += step
+        slots.sort(key=lambda s: s['start'])
+        results.append({
+            'doctor_id': doctor['id'],
+            'name': doctor['name'],
+            'specialty': doctor['specialty'],
+            'fee': doctor['fee'],
+            'slots': slots
+        })
+    return results
+
+
+def book_slot(conn, doctor_id, slot_start, child_id=None, concern='', now=None):
+    """
+    Book one slot atomically
+
+    The insert only happens if the slot lies inside the doctor's schedule
+    and no booking overlaps it; the unique (doctor_id, slot_start) index
+    backs this up. Raises BookingError / SlotTakenError.
+
+    Returns: booking id
+    """
+    try:
+        start = datetime.strptime(slot_start, SLOT_FORMAT)
+    except (TypeError, ValueError):
+        raise BookingError("slot_start must look like 2025-01-31 10:30")
+    if start <= (now or datetime.now()):
+        raise BookingError("Slot is in the past")
+
+    doctor = conn.execute('SELECT slot_minutes FROM doctors WHERE id = ?', (doctor_id,)).fetchone()
+    if not doctor:
+        raise BookingError("Doctor not found")
+    end = start + timedelta(minutes=doctor['slot_minutes'])
+    start_text, end_text = start.strftime(SLOT_FORMAT), end.strftime(SLOT_FORMAT)
+    start_time, end_time = start.strftime('%H:%M'), end.strftime('%H:%M')
+
+    # Slots must line up with the start of the schedule window they fall in
+    window = conn.execute('''
+        SELECT start_time FROM doctor_schedules
+        WHERE doctor_id = ? AND weekday = ? AND start_time <= ? AND end_time >= ?
+    ''', (doctor_id, start.weekday(), start_time, end_time)).fetchone()
+    if not window:
+        raise BookingError("Doctor is not available at that time")
+    offset = start - _at(start.date(), window['start_time'])
+    if offset % timedelta(minutes=doctor['slot_minutes']):
+        raise BookingError("Slot does not match the doctor's schedule")
+
+    try:
+        cursor = conn.execute('''
+            INSERT INTO bookings (doctor_id, child_id, slot_start, slot_end, concern, created_at)
+            SELECT ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM bookings
+                WHERE doctor_id = ? AND slot_start < ? AND slot_end > ?
+            )
+        ''', (doctor_id, child_id, start_text, end_text, concern, datetime.now(),
+              doctor_id, end_text, start_text))
+    except sqlite3.IntegrityError:
+        raise SlotTakenError("Slot already booked")
+
+    if cursor.rowcount == 0:
+        raise SlotTakenError("Slot already booked")
+    return cursor.lastrowid
+
+
+def _at(day, hh_mm):
+    hours, minutes = map(int, hh_mm.split(':'))
+    return datetime(day.year, day.month, day.day, hours, minutes)
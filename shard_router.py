@@ -0,0 +1,119 @@
+"""
+Clinic Shard Router
+Each clinic gets its own SQLite database file so writers in different
+clinics never contend for the same lock. Row ids are globally unique:
+ids in shard k start at k * SHARD_ID_SPAN, so any id encodes its shard.
+"""
+
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_DATABASE = 'database.db'
+DEFAULT_CLINIC = 'default'
+
+# Optional clinic -> shard mapping, e.g.
+# {"default": {"index": 0, "path": "database.db"},
+#  "clinic-north": {"index": 1, "path": "shards/clinic-north.db"}}
+SHARD_CONFIG = os.environ.get('SHARD_CONFIG', 'shards.json')
+
+# Width of each shard's id range (JavaScript-safe up to ~9000 shards)
+SHARD_ID_SPAN = 10 ** 12
+
+# Tables whose AUTOINCREMENT ids are offset per shard
+SHARDED_TABLES = ['children', 'milestones', 'vaccinations', 'growth_records']
+
+# Worker threads used for cross-shard reads
+FANOUT_WORKERS = 8
+
+Shard = namedtuple('Shard', ['index', 'clinic', 'path'])
+
+
+class UnknownClinicError(KeyError):
+    """Raised when a request names a clinic with no shard"""
+
+
+def load_shards(config_path=SHARD_CONFIG):
+    """Read the shard map, falling back to the single default database"""
+    if not os.path.exists(config_path):
+        return {DEFAULT_CLINIC: Shard(0, DEFAULT_CLINIC, DEFAULT_DATABASE)}
+
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    shards = {}
+    indexes = set()
+    for clinic, entry in config.items():
+        index = int(entry['index'])
+        if index in indexes:
+            raise ValueError(f"Duplicate shard index {index} in {config_path}")
+        indexes.add(index)
+        shards[clinic] = Shard(index, clinic, entry['path'])
+
+    if DEFAULT_CLINIC not in shards:
+        raise ValueError(f"{config_path} must define a '{DEFAULT_CLINIC}' shard")
+    return shards
+
+
+_shards = load_shards()
+_shards_by_index = {s.index: s for s in _shards.values()}
+_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='shard-fanout')
+
+
+def all_shards():
+    """Every configured shard, ordered by index"""
+    return sorted(_shards.values(), key=lambda s: s.index)
+
+
+def get_shard(clinic=None):
+    """Shard for a clinic (the default shard if clinic is empty)"""
+    if not clinic:
+        clinic = DEFAULT_CLINIC
+    if clinic not in _shards:
+        raise UnknownClinicError(clinic)
+    return _shards[clinic]
+
+
+def shard_for_id(row_id):
+    """Shard that owns a row id"""
+    index = int(row_id) // SHARD_ID_SPAN
+    if index not in _shards_by_index:
+        raise UnknownClinicError(f"shard {index}")
+    return _shards_by_index[index]
+
+
+def connect(shard, timeout=10.0):
+    """Open a connection to a shard's database"""
+    conn = sqlite3.connect(shard.path, timeout=timeout)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def fan_out(fn, shards=None):
+    """
+    Run fn(shard) for every shard in parallel on the worker pool
+
+    Returns: list of results, in shard order
+    """
+    if shards is None:
+        shards = all_shards()
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    return list(_pool.map(fn, shards))
+
+
+def seed_id_range(conn, shard_index):
+    """Start every sharded table's AUTOINCREMENT counter at its shard offset"""
+    start = shard_index * SHARD_ID_SPAN
+    if start == 0:
+        return
+    for table in SHARDED_TABLES:
+        conn.execute('''
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+        ''', (table, start, table))
+        conn.execute('''
+            UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?
+        ''', (start, table, start))
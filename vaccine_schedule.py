@@ -0,0 +1,33 @@
+"""
+Vaccination Schedule
+Doses created for every new child, as (vaccine name, weeks after birth)
+"""
+
+VACCINE_SCHEDULE = [
+    ("BCG", 0),
+    ("Hepatitis B - Birth dose", 0),
+    ("OPV - 0", 0),
+    ("DTaP - 1st dose", 6),
+    ("IPV - 1st dose", 6),
+    ("Hib - 1st dose", 6),
+    ("Hepatitis B - 1st dose", 6),
+    ("Rotavirus - 1st dose", 6),
+    ("DTaP - 2nd dose", 10),
+    ("IPV - 2nd dose", 10),
+    ("Hib - 2nd dose", 10),
+    ("Rotavirus - 2nd dose", 10),
+    ("DTaP - 3rd dose", 14),
+    ("IPV - 3rd dose", 14),
+    ("Hib - 3rd dose", 14),
+    ("Hepatitis B - 2nd dose", 14),
+    ("Rotavirus - 3rd dose", 14),
+    ("MMR - 1st dose", 36),
+    ("Typhoid", 36),
+    ("MMR - 2nd dose", 60),
+    ("Varicella - 1st dose", 60),
+    ("DTaP Booster", 72),
+    ("IPV Booster", 72),
+]
+
+# Age (weeks) of the last scheduled dose
+LAST_VACCINE_WEEKS = max(weeks for _, weeks in VACCINE_SCHEDULE)